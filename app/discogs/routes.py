@@ -3,14 +3,20 @@ import uuid
 import time
 from datetime import timedelta
 
-from flask import jsonify, request, redirect, url_for, current_app
-
-import discogs_client
+from flask import jsonify, request, redirect, url_for, current_app, Response, stream_with_context
 
 from ..services import discogs
-from ..extensions import redis_client
+from ..extensions import redis_client, session_store
 from . import discogs_bp
 
+# Session fields used by the endpoints that call the Discogs API
+DISCOGS_SESSION_FIELDS = ('discogs_access_token',
+                          'discogs_access_token_secret', 'discogs_identity')
+
+# Folder contents page size limits
+FOLDER_CONTENTS_DEFAULT_PER_PAGE = 100
+FOLDER_CONTENTS_MAX_PER_PAGE = 500
+
 
 @discogs_bp.route('/get_library', methods=['GET'])
 def get_library():
@@ -20,17 +26,15 @@ def get_library():
         return jsonify({"error": "state parameter"}), 400
 
     # Get the redis session with the state key
-    session_key = f"discofy:state:{discogs_state}"
-    session_data = redis_client.get(session_key)
+    session_key = session_store.key(discogs_state)
+    session_data = session_store.get(discogs_state, *DISCOGS_SESSION_FIELDS)
 
-    if not session_data:
+    if session_data is None:
         current_app.logger.error(
             "Requested session key: %s not found in Redis. Session not authorized.", session_key)
         return jsonify({"error": "Unauthorized or expired session"}), 401
 
-    session_data = json.loads(session_data)
-    # session_data = auth_sessions.get(state)
-    if not session_data or 'discogs_access_token' not in session_data or 'discogs_access_token_secret' not in session_data:
+    if 'discogs_access_token' not in session_data or 'discogs_access_token_secret' not in session_data:
         current_app.logger.error(
             "Session tokens not found in session data for session key: %s", session_key)
         return jsonify({"error": "Unauthorized or incomplete Discogs session"}), 401
@@ -40,7 +44,7 @@ def get_library():
         discogs_access_token_secret = session_data['discogs_access_token_secret']
 
         library = discogs.import_library(
-            discogs_access_token, discogs_access_token_secret)
+            discogs_access_token, discogs_access_token_secret, session_data.get('discogs_identity'))
 
         return jsonify({"folders": library})
 
@@ -54,22 +58,27 @@ def get_library():
 def get_folder_contents():
     # Get folder id from query parameters, default to 0 [All records]
     folder_id = request.args.get('folder', 0, type=int)
+    # Re-import the whole folder instead of only the releases added since the last visit
+    refresh = request.args.get('refresh', 'false').lower() in ('1', 'true')
+    # Optional pagination, the whole folder is returned when neither parameter is given
+    page = request.args.get('page', type=int)
+    per_page = request.args.get('per_page', type=int)
+    # Stream releases as newline delimited JSON as they arrive from Discogs
+    stream = request.args.get('format') == 'ndjson'
     discogs_state = request.cookies.get('discogs_state')
 
     if not discogs_state:
         current_app.logger.error("Missing state")
         return jsonify({"error": "state parameter"}), 400
     # Get the redis session with the state key
-    session_key = f"discofy:state:{discogs_state}"
-    session_data = redis_client.get(session_key)
+    session_key = session_store.key(discogs_state)
+    session_data = session_store.get(discogs_state, *DISCOGS_SESSION_FIELDS)
 
-    if not session_data:
+    if session_data is None:
         current_app.logger.error(
             "Requested session key: %s not found in Redis. Session not authorized.", session_key)
         return jsonify({"error": "Unauthorized or expired session"}), 401
 
-    session_data = json.loads(session_data)
-
     if 'discogs_access_token' not in session_data or 'discogs_access_token_secret' not in session_data:
         current_app.logger.error(
             "Session tokens not found in session data for session key: %s", session_key)
@@ -78,11 +87,64 @@ def get_folder_contents():
     try:
         discogs_access_token = session_data['discogs_access_token']
         discogs_access_token_secret = session_data['discogs_access_token_secret']
+        identity = session_data.get('discogs_identity')
+        # The imported releases are recorded under this id, which can be passed to the transfer endpoint
+        snapshot_id = str(uuid.uuid4())
+
+        if stream:
+            # Open the folder before the response starts, so failures still get an error status
+            try:
+                folder = discogs.open_collection_folder(
+                    discogs_access_token, discogs_access_token_secret, folder_id, identity)
+            except Exception as e:
+                current_app.logger.error(
+                    "Error opening collection folder_id=%s: %s", folder_id, e, exc_info=True)
+                return jsonify({"error": "Failed to import collection from Discogs"}), 502
+            if not folder:
+                current_app.logger.error(
+                    "Failed to authenticate Discogs client for the collection stream.")
+                return jsonify({"error": "Unauthorized or expired session"}), 401
+
+            releases = discogs.stream_collection(
+                folder, folder_id, redis_client, refresh, snapshot_id)
+            lines = (json.dumps(release) + '\n' for release in releases)
+            response = Response(stream_with_context(lines),
+                                mimetype='application/x-ndjson')
+            response.headers['X-Accel-Buffering'] = 'no'
+            response.headers['X-Discofy-Snapshot'] = snapshot_id
+            return response
+
+        if page is not None or per_page is not None:
+            page = max(page or 1, 1)
+            per_page = min(max(per_page or FOLDER_CONTENTS_DEFAULT_PER_PAGE, 1),
+                           FOLDER_CONTENTS_MAX_PER_PAGE)
+            # Later pages are read from the snapshot of the first page, without requests to Discogs.
+            # The folder is only imported again if that snapshot is outdated.
+            page_snapshot_id = request.args.get('snapshot')
+            if page > 1 and page_snapshot_id and not refresh:
+                output = discogs.read_collection_snapshot_page(
+                    redis_client, page_snapshot_id, page, per_page)
+                if output is not None:
+                    response = jsonify(output)
+                    response.headers['X-Discofy-Snapshot'] = page_snapshot_id
+                    return response
+
+            output = discogs.import_collection_page(
+                discogs_access_token, discogs_access_token_secret, folder_id, redis_client, page, per_page, refresh, identity,
+                snapshot_id)
+            if output is None:
+                return jsonify({"error": "Failed to import collection from Discogs"}), 502
+            response = jsonify(output)
+            response.headers['X-Discofy-Snapshot'] = snapshot_id
+            return response
 
         output = discogs.import_collection(
-            discogs_access_token, discogs_access_token_secret, folder_id)
+            discogs_access_token, discogs_access_token_secret, folder_id, redis_client, refresh, identity,
+            snapshot_id)
 
-        return jsonify(output)
+        response = jsonify(output)
+        response.headers['X-Discofy-Snapshot'] = snapshot_id
+        return response
 
     except Exception as e:
         current_app.logger.error(
@@ -96,10 +158,9 @@ def get_auth_url():
     current_app.logger.debug("Generating Discogs state identifier")
     discogs_state = str(uuid.uuid4())  # Unique state per request
 
-    d = discogs_client.Client(
-        'discofy/0.1 +discofy.onrender.com',
-        consumer_key=current_app.config.get('DISCOGS_CONSUMER_KEY'),
-        consumer_secret=current_app.config.get('DISCOGS_CONSUMER_SECRET')
+    d = discogs.create_discogs_client(
+        current_app.config.get('DISCOGS_CONSUMER_KEY'),
+        current_app.config.get('DISCOGS_CONSUMER_SECRET')
     )
 
     # Manually append state to callback URL
@@ -116,15 +177,9 @@ def get_auth_url():
     }
 
     # Store in Redis with the state as part of the key
-    session_key = f"discofy:state:{discogs_state}"
     current_app.logger.debug(
-        "Creating session entry in Redis: %s", session_key)
-    redis_client.setex(
-        session_key,
-        timedelta(
-            days=3),  # replace with global variable app.config["PERMANENT_SESSION_LIFETIME"]
-        json.dumps(session_data)
-    )
+        "Creating session entry in Redis: %s", session_store.key(discogs_state))
+    session_store.create(discogs_state, session_data)
 
     response_data = {"authorize_url": url}
     response = jsonify(response_data)
@@ -149,25 +204,21 @@ def callback():
     discogs_state = request.args.get('state')
 
     # Get the redis session with the state key
-    session_key = f"discofy:state:{discogs_state}"
-    session_data_str = redis_client.get(session_key)
+    session_data = session_store.get(discogs_state, 'request_token_secret')
 
-    if not session_data_str:
+    if session_data is None:
         current_app.logger.error('No session data found for Discogs callback.')
         return jsonify({"error": "Invalid or expired session state."}), 400
 
-    session_data = json.loads(session_data_str)
-
     # Retrieve the temporary request token and secret from callback url
     request_token = request.args.get('oauth_token')
     oauth_verifier = request.args.get('oauth_verifier')
 
     request_token_secret = session_data.get('request_token_secret')
 
-    d = discogs_client.Client(
-        'discofy/0.1 +discofy.onrender.com',
-        consumer_key=current_app.config.get('DISCOGS_CONSUMER_KEY'),
-        consumer_secret=current_app.config.get('DISCOGS_CONSUMER_SECRET')
+    d = discogs.create_discogs_client(
+        current_app.config.get('DISCOGS_CONSUMER_KEY'),
+        current_app.config.get('DISCOGS_CONSUMER_SECRET')
     )
 
     # Set the temporary request token and secret to retrieve the access token
@@ -179,20 +230,22 @@ def callback():
 
         current_app.logger.info(
             "Discogs token successfully obtained. Saving in session")
-        # For now, storing it in `auth_sessions` just for the example
-        session_data['discogs_access_token'] = discogs_access_token
-        session_data['discogs_access_token_secret'] = discogs_access_token_secret
-
-        # Clear the request token and secret (no longer needed)
-        session_data.pop('request_token', None)
-        session_data.pop('request_token_secret', None)
-
-        # Update in Redis
-        redis_client.setex(
-            session_key,
-            timedelta(days=3),
-            json.dumps(session_data)
-        )
+        session_data = {
+            'discogs_access_token': discogs_access_token,
+            'discogs_access_token_secret': discogs_access_token_secret
+        }
+
+        # Cache the user's identity so later requests don't need to ask Discogs for it
+        try:
+            session_data['discogs_identity'] = discogs.get_identity_data(
+                d.identity())
+        except Exception as e:
+            current_app.logger.warning(
+                "Failed to fetch Discogs identity, it will be requested on demand: %s", e)
+
+        # Update in Redis and clear the request token and secret (no longer needed)
+        session_store.set(discogs_state, session_data,
+                          remove=['request_token', 'request_token_secret'])
 
         return redirect(url_for('auth.success'))
     except Exception as e:
@@ -214,28 +267,34 @@ def check_authorization():
         }), 200
 
     # Get the redis session with the state key
-    session_key = f"discofy:state:{discogs_state}"
-    session_data_str = redis_client.get(session_key)
+    session_data = session_store.get(discogs_state, *DISCOGS_SESSION_FIELDS)
 
-    if not session_data_str:
+    if session_data is None:
         current_app.logger.warning(
-            "User not authorized. Session data could not be found for session key: %s", session_key)
+            "User not authorized. Session data could not be found for session key: %s", session_store.key(discogs_state))
         return jsonify({'authorized': False})
 
-    session_data = json.loads(session_data_str)
-
     if 'discogs_access_token' in session_data and 'discogs_access_token_secret' in session_data:
-        discogs_access_token = session_data['discogs_access_token']
-        discogs_access_token_secret = session_data['discogs_access_token_secret']
-        # Retrieve connected user data
-        current_user = discogs.getCurrentUser(discogs_access_token, discogs_access_token_secret)
+        identity = session_data.get('discogs_identity')
+        if not identity:
+            # Session created before identities were cached, fetch it once and store it
+            discogs_access_token = session_data['discogs_access_token']
+            discogs_access_token_secret = session_data['discogs_access_token_secret']
+            # Retrieve connected user data
+            current_user = discogs.getCurrentUser(
+                discogs_access_token, discogs_access_token_secret)
+            if not current_user:
+                return jsonify({'authorized': False})
+            identity = discogs.get_identity_data(current_user)
+            session_store.set(discogs_state, {'discogs_identity': identity})
+
         current_app.logger.info(
-            "User %s connected to Discogs successfully", current_user.username)
+            "User %s connected to Discogs successfully", identity['username'])
         return jsonify({
             'authorized': True,
-            'username': current_user.username,
-            'user_id': current_user.id,
-            'url': current_user.url
+            'username': identity['username'],
+            'user_id': identity['id'],
+            'url': identity['url']
         })
     else:
         return jsonify({'authorized': False})
@@ -253,10 +312,9 @@ def logout():
             "message": "No session found."
         }), 400
 
-    session_key = f"discofy:state:{discogs_state}"
-
-    current_app.logger.info("Removing session: %s from Redis", session_key)
-    redis_client.delete(session_key)
+    current_app.logger.info(
+        "Removing session: %s from Redis", session_store.key(discogs_state))
+    session_store.delete(discogs_state)
 
     response = jsonify({
         "status": "success",
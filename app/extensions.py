@@ -6,13 +6,17 @@ from flask_cors import CORS
 import logging
 import sys
 
+from .services.session_store import SessionStore, SESSION_KEY_PREFIX
+from .services.sweeper import sweep_keys
+
 logger = logging.getLogger(__name__)
 
 # Initialize Flask-Session
 session = Session()
 
-# Initialize Redis client
+# Initialize Redis client and the session store built on it
 redis_client = None
+session_store = None
 
 
 def init_logging(app=None):
@@ -39,8 +43,9 @@ def init_logging(app=None):
 
 
 def init_redis(app):
-    global redis_client
+    global redis_client, session_store
     redis_client = redis.from_url(app.config['SESSION_REDIS'])
+    session_store = SessionStore(redis_client)
     logger.info("Initialized Redis client with URL: %s",
                 app.config['SESSION_REDIS'])
 
@@ -69,7 +74,7 @@ def init_cors(app):
     CORS(app,
          supports_credentials=True,
          origins=allowed_origins,
-         expose_headers=['Set-Cookie'],
+         expose_headers=['Set-Cookie', 'X-Discofy-Snapshot'],
          allow_headers=['Content-Type', 'Authorization'],
          methods=['GET', 'POST', 'OPTIONS', 'PUT', 'DELETE'],
          vary_header=True)
@@ -78,18 +83,11 @@ def init_cors(app):
 
 def cleanup_expired_sessions():
     """
-    Function to clean up expired sessions
-    This can be run periodically using a scheduler or cron job
+    Function to clean up sessions left without an expiry.
+    Sessions are swept incrementally with SCAN. The celery beat job sweep_redis_task sweeps the same
+    keys with sweep_redis, together with the progress and task results, so this is only needed for
+    a one-off cleanup.
     """
-    pattern = "discofy:state:*"
-    keys = redis_client.keys(pattern)
-    count = 0
-
-    for key in keys:
-        ttl = redis_client.ttl(key)
-        if ttl <= 0:  # Already expired or no expiry
-            redis_client.delete(key)
-            count += 1
-
+    count = sweep_keys(redis_client, f"{SESSION_KEY_PREFIX}*")
     logger.info("Cleaned up %d expired sessions", count)
     return count
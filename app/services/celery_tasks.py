@@ -1,8 +1,16 @@
 import os
+from datetime import timedelta
 
-from celery import Celery
+from celery import Celery, chord
 
-from .spotify import transfer_from_discogs
+from .discogs import load_collection_snapshot
+from .session_store import SESSION_KEY_PREFIX
+from .spotify import (match_collection_items,
+                      start_transfer_progress, finish_transfer_progress, create_playlist, SessionToken,
+                      store_transfer_result, read_transfer_result, store_transfer_input, read_transfer_input,
+                      transfer_input_key, celery_redis_client, TRANSFER_PROGRESS_PREFIX,
+                      PLAYLIST_PROGRESS_PREFIX, PROGRESS_TTL, TRANSFER_RESULT_TTL)
+from .sweeper import sweep_redis
 
 # Celery and Redis client configuration
 celery = Celery(
@@ -10,8 +18,98 @@ celery = Celery(
     broker=os.environ.get('REDIS_URL', 'redis://redis:6379'),
     backend=os.environ.get('REDIS_URL', 'redis://redis:6379')
 )
+# Task results, including the chunk results a chord collects, expire with the stored transfer results
+celery.conf.result_expires = TRANSFER_RESULT_TTL
 
+# Collections larger than this are split into chunks processed by all available workers
+TRANSFER_CHUNK_SIZE = int(os.environ.get('TRANSFER_CHUNK_SIZE', 200))
 
+# Celery beat sweeps Redis for keys left without an expiry every REDIS_SWEEP_INTERVAL seconds
+REDIS_SWEEP_INTERVAL = int(os.environ.get('REDIS_SWEEP_INTERVAL', 60 * 60))
+
+
+# Transfer tasks store their result with store_transfer_result and return only its summary.
+# Tasks receive the state of the user's session rather than an access token,
+# so that they can refresh the token themselves when a run outlasts it.
 @celery.task(bind=True)
-def transfer_collection_task(self, collection_items, access_token, progress_key):
-    return transfer_from_discogs(collection_items, access_token, progress_key)
+def transfer_collection_task(self, collection_items, spotify_state, progress_key, snapshot_id=None, discogs_ids=None):
+    # Collections referred to by a snapshot are loaded here rather than sent with the task
+    if snapshot_id is not None:
+        collection_items = load_collection_snapshot(
+            celery_redis_client, snapshot_id, discogs_ids)
+        if collection_items is None:
+            raise LookupError(
+                f"Collection snapshot {snapshot_id} has expired or is outdated")
+
+    # Progress is only marked finished once the result is stored, so clients that see it can read the result
+    if len(collection_items) <= TRANSFER_CHUNK_SIZE:
+        start_transfer_progress(progress_key, len(collection_items))
+        export_items = match_collection_items(
+            collection_items, SessionToken(spotify_state), progress_key)
+        summary = store_transfer_result(progress_key, export_items)
+        finish_transfer_progress(progress_key)
+        return summary
+
+    # Fan the collection out into chunks and merge their results with a chord.
+    # The chord callback takes over this task's id, so clients keep polling the same task_id.
+    # Chunks read their range of the collection from Redis, which keeps the task messages small.
+    start_transfer_progress(progress_key, len(collection_items))
+    store_transfer_input(progress_key, collection_items)
+    header = [transfer_chunk_task.s(spotify_state, progress_key, start, start + TRANSFER_CHUNK_SIZE)
+              for start in range(0, len(collection_items), TRANSFER_CHUNK_SIZE)]
+
+    return self.replace(chord(header, merge_transfer_chunks_task.s(progress_key)))
+
+
+@celery.task(bind=True)
+def transfer_chunk_task(self, spotify_state, progress_key, start, stop):
+    collection_items = read_transfer_input(progress_key, start, stop)
+    export_items = match_collection_items(
+        collection_items, SessionToken(spotify_state), progress_key)
+    return store_transfer_result(f"{progress_key}:{self.request.id}", export_items)
+
+
+@celery.task
+def merge_transfer_chunks_task(chunk_results, progress_key):
+    # Chord results are ordered like the chunks, which keeps the original collection order
+    export_items = []
+    for chunk_summary in chunk_results:
+        chunk_items = read_transfer_result(celery_redis_client, chunk_summary)
+        if chunk_items is None:
+            raise LookupError(
+                f"Result of a chunk of transfer {progress_key} has expired")
+        export_items.extend(chunk_items)
+
+    summary = store_transfer_result(progress_key, export_items)
+    celery_redis_client.delete(transfer_input_key(progress_key),
+                               *[chunk_summary['result_key'] for chunk_summary in chunk_results])
+    finish_transfer_progress(progress_key)
+    return summary
+
+
+@celery.task
+def create_playlist_task(playlist_items, name, spotify_state, progress_key):
+    return create_playlist(playlist_items, name, SessionToken(spotify_state), progress_key)
+
+
+@celery.task
+def sweep_redis_task():
+    # Sessions without an expiry are leftovers and are removed. Progress keys and task results
+    # written before they were given an expiry (or by a crashed task) are set to expire instead.
+    result_ttl = celery.conf.result_expires
+    if isinstance(result_ttl, timedelta):
+        result_ttl = int(result_ttl.total_seconds())
+    return sweep_redis(celery_redis_client, [
+        (f"{SESSION_KEY_PREFIX}*", None),
+        (f"{TRANSFER_PROGRESS_PREFIX}*", PROGRESS_TTL),
+        (f"{PLAYLIST_PROGRESS_PREFIX}*", PROGRESS_TTL),
+        ("celery-task-meta-*", result_ttl or PROGRESS_TTL),
+    ])
+
+
+celery.conf.beat_schedule = {
+    'sweep-redis': {
+        'task': sweep_redis_task.name,
+        'schedule': REDIS_SWEEP_INTERVAL,
+    },
+}
@@ -1,5 +1,9 @@
 import os
 import re
+import json
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import discogs_client
 from dotenv import load_dotenv
@@ -10,17 +14,69 @@ load_dotenv()
 consumer_key = os.getenv('DISCOGS_CONSUMER_KEY')
 consumer_secret = os.getenv('DISCOGS_CONSUMER_SECRET')
 
+# Discogs endpoints, can be pointed at a local API emulator for load testing
+DISCOGS_USER_AGENT = 'discofy/0.1 +discofy.onrender.com'
+DISCOGS_API_URL = os.getenv('DISCOGS_API_URL', 'https://api.discogs.com')
+DISCOGS_AUTHORIZE_URL = os.getenv(
+    'DISCOGS_AUTHORIZE_URL', 'https://www.discogs.com/oauth/authorize')
+
+# Largest page size accepted by the Discogs API and number of collection pages fetched in parallel
+DISCOGS_PER_PAGE = 100
+DISCOGS_IMPORT_CONCURRENCY = int(os.getenv('DISCOGS_IMPORT_CONCURRENCY', 4))
+
+# Per-user, per-folder collection cache, refreshed with the releases added since the last import
+COLLECTION_CACHE_PREFIX = "discofy:collection:"
+COLLECTION_CACHE_TTL = int(os.getenv('COLLECTION_CACHE_TTL', 60 * 60 * 24 * 30))
+# Number of cached releases read from Redis at a time while streaming a folder
+COLLECTION_STREAM_CHUNK_SIZE = 500
+# Full imports are written to keys of their own and renamed into place once complete, the keys of an
+# abandoned import expire after COLLECTION_IMPORT_TTL seconds without a new page
+COLLECTION_IMPORT_TTL = 60 * 60
+# Snapshots let a transfer refer to the releases a user was shown instead of posting them back
+COLLECTION_SNAPSHOT_PREFIX = "discofy:collection_snapshot:"
+COLLECTION_SNAPSHOT_TTL = int(os.getenv('COLLECTION_SNAPSHOT_TTL', 60 * 60 * 24))
+
+
+def create_discogs_client(consumer_key, consumer_secret, token=None, secret=None):
+    """
+    Creates a Discogs API client configured with the application's user agent and API endpoints.
+
+    Args:
+        consumer_key (str): Discogs application consumer key.
+        consumer_secret (str): Discogs application consumer secret.
+        token (str, optional): OAuth access token. Defaults to None.
+        secret (str, optional): OAuth access token secret. Defaults to None.
 
-def initialize_discogs_client(discogs_access_token, discogs_access_token_secret):
+    Returns:
+        discogs_client.Client: The configured client.
+    """
+    d = discogs_client.Client(
+        DISCOGS_USER_AGENT,
+        consumer_key=consumer_key,
+        consumer_secret=consumer_secret,
+        token=token,
+        secret=secret,
+    )
+    d._base_url = DISCOGS_API_URL
+    d._request_token_url = f"{DISCOGS_API_URL}/oauth/request_token"
+    d._access_token_url = f"{DISCOGS_API_URL}/oauth/access_token"
+    d._authorize_url = DISCOGS_AUTHORIZE_URL
+    return d
+
+
+def initialize_discogs_client(discogs_access_token, discogs_access_token_secret, identity=None):
     """
     Initializes and authenticates a Discogs API client.
 
     Uses OAuth tokens to authenticate with the Discogs API and returns the
-    authenticated user's identity object.
+    authenticated user's identity object. When the identity cached in the session
+    is given, the user object is built from it without requesting /oauth/identity.
 
     Args:
         discogs_access_token (str): OAuth access token for Discogs API.
         discogs_access_token_secret (str): OAuth access token secret for Discogs API.
+        identity (dict, optional): Cached identity with 'username', 'id' and 'url', see get_identity_data.
+            Defaults to None.
 
     Returns:
         discogs_client.Identity or None: The authenticated user's identity object,
@@ -31,13 +87,24 @@ def initialize_discogs_client(discogs_access_token, discogs_access_token_secret)
         return None
 
     try:
-        d = discogs_client.Client(
-            'discofy/0.1 +discofy.onrender.com',
-            consumer_key=consumer_key,
-            consumer_secret=consumer_secret,
+        d = create_discogs_client(
+            consumer_key,
+            consumer_secret,
             token=discogs_access_token,
             secret=discogs_access_token_secret,
         )
+        if identity and identity.get('username'):
+            # Prefill the fields that would otherwise be loaded from the user's profile
+            me = discogs_client.models.User(d, {
+                'id': identity.get('id'),
+                'username': identity['username'],
+                'uri': identity.get('url'),
+                'collection_folders_url': f"{DISCOGS_API_URL}/users/{identity['username']}/collection/folders",
+            })
+            current_app.logger.debug(
+                "Initialized Discogs client from cached identity for user: %s", me.username)
+            return me
+
         me = d.identity()
         current_app.logger.info("Successfully initialized Discogs client for user: %s", getattr(
             me, 'username', 'unknown'))
@@ -48,7 +115,25 @@ def initialize_discogs_client(discogs_access_token, discogs_access_token_secret)
         return None
 
 
-def import_library(discogs_access_token, discogs_access_token_secret):
+def get_identity_data(me):
+    """
+    Extracts the identity fields cached in the session from a Discogs user object.
+    Reading the profile url requests the user's profile if it has not been loaded yet.
+
+    Args:
+        me (discogs_client.models.User): The authenticated user.
+
+    Returns:
+        dict: The user's 'username', 'id' and profile 'url'.
+    """
+    return {
+        'username': me.username,
+        'id': me.id,
+        'url': me.url
+    }
+
+
+def import_library(discogs_access_token, discogs_access_token_secret, identity=None):
     """
     Fetches the user's Discogs library folder structure.
 
@@ -59,6 +144,7 @@ def import_library(discogs_access_token, discogs_access_token_secret):
     Args:
         discogs_access_token (str): OAuth access token for Discogs API.
         discogs_access_token_secret (str): OAuth access token secret for Discogs API.
+        identity (dict, optional): Identity cached in the session. Defaults to None.
 
     Returns:
         dict: A dictionary containing:
@@ -66,7 +152,7 @@ def import_library(discogs_access_token, discogs_access_token_secret):
             - 'library': A list of folders with index, folder name, and record count.
     """
     me = initialize_discogs_client(
-        discogs_access_token, discogs_access_token_secret)
+        discogs_access_token, discogs_access_token_secret, identity)
 
     if not me:
         current_app.logger.error(
@@ -97,22 +183,31 @@ def import_library(discogs_access_token, discogs_access_token_secret):
     return library
 
 
-def import_collection(discogs_access_token, discogs_access_token_secret, folder_id=0):
+def import_collection(discogs_access_token, discogs_access_token_secret, folder_id=0, redis_client=None, refresh=False, identity=None, snapshot_id=None):
     """
-    Imports a user's Discogs collection data from a specified folder.
+    Imports a user's Discogs collection data from a specified folder, most recently added releases first.
+
+    When a Redis client is given, the folder is kept in the collection cache and only releases added
+    since the last import are requested from Discogs. The whole folder is downloaded again if releases
+    were removed in the meantime or if refresh is set.
 
     Args:
         discogs_access_token (str): OAuth access token for the Discogs API.
         discogs_access_token_secret (str): OAuth access token secret for the Discogs API.
         folder_id (int, optional): ID of the collection folder to import from. Defaults to 0 (the "All" folder).
+        redis_client (redis.Redis, optional): Redis client for the collection cache. Defaults to None (no caching).
+        refresh (bool, optional): Ignore the cached folder and import it in full. Defaults to False.
+        identity (dict, optional): Identity cached in the session. Defaults to None.
+        snapshot_id (str, optional): Record the imported releases as a collection snapshot with this id,
+            requires a Redis client. Defaults to None.
 
     Returns:
         list[dict]: A list of dictionaries, each representing a release in the collection.
     """
-    me = initialize_discogs_client(
-        discogs_access_token, discogs_access_token_secret)
+    folder = open_collection_folder(
+        discogs_access_token, discogs_access_token_secret, folder_id, identity)
 
-    if not me:
+    if not folder:
         current_app.logger.error(
             "Failed to authenticate Discogs client in import_collection.")
         return []
@@ -121,36 +216,25 @@ def import_collection(discogs_access_token, discogs_access_token_secret, folder_
         "Importing Discogs collection for folder_id=%s", folder_id)
     collection = []
     try:
-        # Get folder items data and append to collection
-        selected_folder = me.collection_folders[folder_id]
-        selected_folder_albums = selected_folder.releases
+        selected_folder, releases, cache_key = folder
+        if redis_client is None:
+            selected_folder_albums = [build_release(item)
+                                      for item in fetch_folder_releases(releases)]
+        else:
+            sync_collection_cache(
+                redis_client, cache_key, releases, selected_folder.count, refresh)
+            selected_folder_albums = read_collection_cache(
+                redis_client, cache_key)
+            if snapshot_id:
+                record_collection_snapshot(
+                    redis_client, snapshot_id, cache_key, len(selected_folder_albums))
+
+        total = len(selected_folder_albums)
         for index, item in enumerate(selected_folder_albums, start=1):
-            basic_info = item.data.get('basic_information', {})
-            formats = basic_info.get('formats', [{}])[0]
-            artist = [sanitise_string(a.get('name'))
-                      for a in basic_info.get('artists', [])]
-            title = basic_info.get('title')
-            year = basic_info.get('year')
-            discogs_id = basic_info.get('id')
-            thumb = basic_info.get('thumb')
-            format_name = formats.get('name')
-            descriptions = formats.get('descriptions')
-            url = f"https://www.discogs.com/release/{discogs_id}"
-
-            release = {
-                'index': index,
-                'artists': artist,
-                'title': title,
-                'year': year,
-                'discogs_id': discogs_id,
-                'cover': thumb,
-                'format': format_name,
-                'descriptions': descriptions,
-                'url': url
-            }
+            release = {'index': index, **item}
 
             current_app.logger.debug(
-                "[%d out of %d] Imported item: '%s - %s', discogs_id: %s", index, len(selected_folder_albums), artist, title, discogs_id)
+                "[%d out of %d] Imported item: '%s - %s', discogs_id: %s", index, total, release['artists'], release['title'], release['discogs_id'])
 
             collection.append(release)
 
@@ -164,6 +248,563 @@ def import_collection(discogs_access_token, discogs_access_token_secret, folder_
     return collection
 
 
+def import_collection_page(discogs_access_token, discogs_access_token_secret, folder_id, redis_client, page, per_page, refresh=False, identity=None, snapshot_id=None):
+    """
+    Imports one page of a user's Discogs collection folder, most recently added releases first.
+    The folder is brought up to date in the collection cache and only the requested page is read from it.
+
+    Args:
+        discogs_access_token (str): OAuth access token for the Discogs API.
+        discogs_access_token_secret (str): OAuth access token secret for the Discogs API.
+        folder_id (int): ID of the collection folder to import from.
+        redis_client (redis.Redis): Redis client for the collection cache.
+        page (int): Page number, starting at 1.
+        per_page (int): Number of releases per page.
+        refresh (bool, optional): Ignore the cached folder and import it in full. Defaults to False.
+        identity (dict, optional): Identity cached in the session. Defaults to None.
+        snapshot_id (str, optional): Record the whole folder as a collection snapshot with this id. Defaults to None.
+
+    Returns:
+        dict or None: 'releases' of the page and 'pagination' with page, pages, per_page and items counts,
+        or None if the folder could not be imported.
+    """
+    folder = open_collection_folder(
+        discogs_access_token, discogs_access_token_secret, folder_id, identity)
+
+    if not folder:
+        current_app.logger.error(
+            "Failed to authenticate Discogs client in import_collection_page.")
+        return None
+
+    try:
+        selected_folder, releases, cache_key = folder
+        total = sync_collection_cache(
+            redis_client, cache_key, releases, selected_folder.count, refresh)
+        start = (page - 1) * per_page
+        page_releases = read_collection_cache(
+            redis_client, cache_key, start, start + per_page - 1)
+        if snapshot_id:
+            record_collection_snapshot(
+                redis_client, snapshot_id, cache_key, total)
+    except Exception as e:
+        current_app.logger.error(
+            "Error importing collection page %d from folder_id=%s: %s", page, folder_id, e, exc_info=True)
+        return None
+
+    current_app.logger.info(
+        "Imported page %d with %d of %d releases from folder_id=%s", page, len(page_releases), total, folder_id)
+    return build_collection_page(page_releases, page, per_page, total)
+
+
+def read_collection_snapshot_page(redis_client, snapshot_id, page, per_page):
+    """
+    Reads one page of a collection snapshot from the collection cache, without any Discogs requests.
+    Used for the pages after the first, which refer to the snapshot recorded when the first page was imported,
+    so the releases don't shift between pages when releases are added to the folder in the meantime.
+
+    Args:
+        redis_client (redis.Redis): Redis client for the collection cache.
+        snapshot_id (str): Id of the snapshot.
+        page (int): Page number, starting at 1.
+        per_page (int): Number of releases per page.
+
+    Returns:
+        dict or None: 'releases' of the page and 'pagination', see import_collection_page, or None if the
+        snapshot has expired or the folder has been imported in full since.
+    """
+    snapshot = redis_client.hgetall(f"{COLLECTION_SNAPSHOT_PREFIX}{snapshot_id}")
+    if not snapshot:
+        return None
+
+    cache_key = snapshot[b'cache_key'].decode()
+    total = int(snapshot[b'count'])
+    start = (page - 1) * per_page
+    stop = min(start + per_page, total)
+
+    pipe = redis_client.pipeline()
+    pipe.get(f"{cache_key}:generation")
+    pipe.llen(cache_key)
+    # The snapshot's releases are the oldest total releases, later additions are at the head of the list
+    if start < stop:
+        pipe.lrange(cache_key, start - total, stop - total - 1)
+    generation, length, *values = pipe.execute()
+    if (generation or b'') != snapshot[b'generation'] or length < total:
+        return None
+
+    page_releases = [json.loads(value) for value in values[0]] if values else []
+    return build_collection_page(page_releases, page, per_page, total)
+
+
+def build_collection_page(page_releases, page, per_page, total):
+    """
+    Builds the response of one page of a collection folder.
+
+    Args:
+        page_releases (list[dict]): Release dictionaries of the page without index.
+        page (int): Page number, starting at 1.
+        per_page (int): Number of releases per page.
+        total (int): Number of releases in the folder.
+
+    Returns:
+        dict: 'releases' of the page with their position in the collection as 'index', and 'pagination' with
+        page, pages, per_page and items counts.
+    """
+    start = (page - 1) * per_page
+    return {
+        'releases': [{'index': start + index, **release} for index, release in enumerate(page_releases, start=1)],
+        'pagination': {
+            'page': page,
+            'pages': max((total + per_page - 1) // per_page, 1),
+            'per_page': per_page,
+            'items': total
+        }
+    }
+
+
+def stream_collection(folder, folder_id, redis_client, refresh=False, snapshot_id=None):
+    """
+    Yields the releases of a user's Discogs collection folder, most recently added releases first.
+
+    An up to date cached folder is read back from Redis in chunks. Otherwise releases are yielded page by
+    page as they arrive from Discogs while the folder is written to the collection cache, so neither
+    case holds the whole collection in memory.
+
+    The folder is opened by the caller with open_collection_folder, so authentication and lookup failures
+    can be reported before the stream starts. A failure while streaming ends the stream with an 'error'
+    dictionary instead of a release.
+
+    Args:
+        folder (tuple): Folder, releases and cache key as returned by open_collection_folder.
+        folder_id (int): ID of the collection folder to import from.
+        redis_client (redis.Redis): Redis client for the collection cache.
+        refresh (bool, optional): Ignore the cached folder and import it in full. Defaults to False.
+        snapshot_id (str, optional): Record the streamed releases as a collection snapshot with this id once
+            the whole folder has been streamed. Defaults to None.
+
+    Yields:
+        dict: Release dictionaries with their position in the collection as 'index', or a final dictionary
+        with an 'error' message if the folder could not be streamed in full.
+    """
+    selected_folder, releases, cache_key = folder
+    index = 0
+    try:
+        total = None if refresh else refresh_collection_cache(
+            redis_client, cache_key, releases, selected_folder.count)
+
+        if total is not None:
+            for start in range(0, total, COLLECTION_STREAM_CHUNK_SIZE):
+                for release in read_collection_cache(
+                        redis_client, cache_key, start, start + COLLECTION_STREAM_CHUNK_SIZE - 1):
+                    index += 1
+                    yield {'index': index, **release}
+        else:
+            for page_releases in import_collection_to_cache(redis_client, cache_key, releases):
+                for release in page_releases:
+                    index += 1
+                    yield {'index': index, **release}
+
+        if snapshot_id:
+            record_collection_snapshot(
+                redis_client, snapshot_id, cache_key, index)
+        current_app.logger.info(
+            "Streamed %d releases from folder_id=%s", index, folder_id)
+
+    except Exception as e:
+        current_app.logger.error(
+            "Error streaming collection from folder_id=%s after %d releases: %s", folder_id, index, e, exc_info=True)
+        yield {'error': "Failed to import collection from Discogs"}
+
+
+def open_collection_folder(discogs_access_token, discogs_access_token_secret, folder_id, identity=None):
+    """
+    Looks up a collection folder of the authenticated user.
+
+    Args:
+        discogs_access_token (str): OAuth access token for the Discogs API.
+        discogs_access_token_secret (str): OAuth access token secret for the Discogs API.
+        folder_id (int): ID of the collection folder.
+        identity (dict, optional): Identity cached in the session. Defaults to None.
+
+    Returns:
+        tuple or None: The folder, its releases sorted by date added descending and the folder's
+        collection cache key, or None if the client could not be authenticated.
+    """
+    me = initialize_discogs_client(
+        discogs_access_token, discogs_access_token_secret, identity)
+    if not me:
+        return None
+
+    selected_folder = me.collection_folders[folder_id]
+    releases = selected_folder.releases.sort('added', 'desc')
+    cache_key = f"{COLLECTION_CACHE_PREFIX}{me.username}:{selected_folder.id}"
+    return selected_folder, releases, cache_key
+
+
+def sync_collection_cache(redis_client, cache_key, releases, folder_count, refresh=False):
+    """
+    Brings the cached copy of a collection folder up to date, see refresh_collection_cache.
+    The folder is imported in full if it is not cached, out of date or refresh is set.
+
+    Args:
+        redis_client (redis.Redis): Redis client for the collection cache.
+        cache_key (str): Redis key of the cached folder.
+        releases (discogs_client.models.PaginatedList): Releases of the folder, sorted by date added descending.
+        folder_count (int): Number of releases in the folder according to Discogs.
+        refresh (bool, optional): Ignore the cached folder and import it in full. Defaults to False.
+
+    Returns:
+        int: Number of releases in the cached folder.
+    """
+    if not refresh:
+        total = refresh_collection_cache(
+            redis_client, cache_key, releases, folder_count)
+        if total is not None:
+            return total
+
+    total = 0
+    for page_releases in import_collection_to_cache(redis_client, cache_key, releases):
+        total += len(page_releases)
+    return total
+
+
+def refresh_collection_cache(redis_client, cache_key, releases, folder_count):
+    """
+    Adds the releases added since the last import to the cached copy of a collection folder.
+
+    The cache holds a list of releases, most recently added first, a set of their instance ids and
+    a generation token that changes with every full import.
+    Releases are requested newest first until the first one already in the cache. If the cached and
+    new releases do not add up to the folder count, releases were removed and the cache can't be used.
+
+    Args:
+        redis_client (redis.Redis): Redis client for the collection cache.
+        cache_key (str): Redis key of the cached folder.
+        releases (discogs_client.models.PaginatedList): Releases of the folder, sorted by date added descending.
+        folder_count (int): Number of releases in the folder according to Discogs.
+
+    Returns:
+        int or None: Number of releases in the cached folder, or None if the folder has to be imported in full.
+    """
+    instances_key = f"{cache_key}:instances"
+
+    pipe = redis_client.pipeline()
+    pipe.llen(cache_key)
+    pipe.scard(instances_key)
+    cached_count, instance_count = pipe.execute()
+
+    if not cached_count or cached_count != instance_count:
+        return None
+
+    new_releases = fetch_new_folder_releases(
+        releases, redis_client, instances_key)
+    if cached_count + len(new_releases) != folder_count:
+        current_app.logger.info(
+            "Collection cache %s has %d releases with %d new, Discogs folder has %d. Importing in full",
+            cache_key, cached_count, len(new_releases), folder_count)
+        return None
+
+    current_app.logger.info(
+        "Collection cache %s is missing %d new releases", cache_key, len(new_releases))
+    pipe = redis_client.pipeline()
+    if new_releases:
+        # Push the oldest first so the newest release ends up at the head of the list
+        pipe.lpush(cache_key, *[json.dumps(release)
+                   for release in reversed(new_releases)])
+        pipe.sadd(instances_key, *[release['instance_id']
+                  for release in new_releases])
+    pipe.expire(cache_key, COLLECTION_CACHE_TTL)
+    pipe.expire(instances_key, COLLECTION_CACHE_TTL)
+    pipe.expire(f"{cache_key}:generation", COLLECTION_CACHE_TTL)
+    pipe.execute()
+
+    return cached_count + len(new_releases)
+
+
+def import_collection_to_cache(redis_client, cache_key, releases):
+    """
+    Replaces the cached copy of a collection folder with a full import, written page by page.
+
+    The pages are written to keys of this import and renamed over the cached folder once the import is
+    complete, so concurrent imports of the same folder don't mix their releases and readers keep seeing the
+    previous copy until then. An import that is not run to completion leaves the cached folder unchanged.
+
+    Args:
+        redis_client (redis.Redis): Redis client for the collection cache.
+        cache_key (str): Redis key of the cached folder.
+        releases (discogs_client.models.PaginatedList): Releases of the folder, sorted by date added descending.
+
+    Yields:
+        list[dict]: Release dictionaries without index of each page, in collection order.
+    """
+    instances_key = f"{cache_key}:instances"
+    import_key = f"{cache_key}:import:{uuid.uuid4().hex}"
+    import_instances_key = f"{import_key}:instances"
+    total = 0
+
+    for items in iter_folder_pages(releases):
+        page_releases = [build_release(item) for item in items]
+        if page_releases:
+            pipe = redis_client.pipeline()
+            pipe.rpush(import_key, *[json.dumps(release)
+                       for release in page_releases])
+            pipe.sadd(import_instances_key, *[release['instance_id']
+                      for release in page_releases])
+            pipe.expire(import_key, COLLECTION_IMPORT_TTL)
+            pipe.expire(import_instances_key, COLLECTION_IMPORT_TTL)
+            pipe.execute()
+            total += len(page_releases)
+        yield page_releases
+
+    pipe = redis_client.pipeline()
+    if total:
+        pipe.rename(import_key, cache_key)
+        pipe.rename(import_instances_key, instances_key)
+        pipe.expire(cache_key, COLLECTION_CACHE_TTL)
+        pipe.expire(instances_key, COLLECTION_CACHE_TTL)
+    else:
+        pipe.delete(cache_key, instances_key)
+    # Snapshots of the previous import no longer match the cached releases
+    pipe.set(f"{cache_key}:generation", uuid.uuid4().hex,
+             ex=COLLECTION_CACHE_TTL)
+    pipe.execute()
+
+
+def read_collection_cache(redis_client, cache_key, start=0, stop=-1):
+    """
+    Reads releases from the cached copy of a collection folder.
+
+    Args:
+        redis_client (redis.Redis): Redis client for the collection cache.
+        cache_key (str): Redis key of the cached folder.
+        start (int, optional): Position of the first release, starting at 0. Defaults to 0.
+        stop (int, optional): Position of the last release, inclusive. Defaults to -1 (the last release).
+
+    Returns:
+        list[dict]: Release dictionaries without index.
+    """
+    return [json.loads(value) for value in redis_client.lrange(cache_key, start, stop)]
+
+
+def record_collection_snapshot(redis_client, snapshot_id, cache_key, count):
+    """
+    Records the releases of a cached folder a user has been shown as a collection snapshot.
+
+    New releases are only ever added at the head of the cached list and a full import changes the
+    cache generation, so a snapshot is the number of releases and the generation at the time, rather
+    than a copy of the releases.
+
+    Args:
+        redis_client (redis.Redis): Redis client for the collection cache.
+        snapshot_id (str): Id of the new snapshot.
+        cache_key (str): Redis key of the cached folder.
+        count (int): Number of releases shown, counted from the oldest release.
+    """
+    generation = redis_client.get(f"{cache_key}:generation") or b''
+    snapshot_key = f"{COLLECTION_SNAPSHOT_PREFIX}{snapshot_id}"
+    pipe = redis_client.pipeline()
+    pipe.hset(snapshot_key, mapping={
+        'cache_key': cache_key,
+        'count': count,
+        'generation': generation
+    })
+    pipe.expire(snapshot_key, COLLECTION_SNAPSHOT_TTL)
+    pipe.execute()
+
+
+def current_collection_snapshot(redis_client, snapshot_id):
+    """
+    Reads a collection snapshot if its releases are still in the collection cache, without reading the releases.
+
+    Args:
+        redis_client (redis.Redis): Redis client for the collection cache.
+        snapshot_id (str): Id of the snapshot.
+
+    Returns:
+        dict or None: The snapshot's 'cache_key', 'count' and 'generation', or None if the snapshot has expired
+        or the folder has been imported in full since.
+    """
+    snapshot = redis_client.hgetall(f"{COLLECTION_SNAPSHOT_PREFIX}{snapshot_id}")
+    if not snapshot:
+        return None
+
+    snapshot = {
+        'cache_key': snapshot[b'cache_key'].decode(),
+        'count': int(snapshot[b'count']),
+        'generation': snapshot[b'generation'].decode()
+    }
+    pipe = redis_client.pipeline()
+    pipe.get(f"{snapshot['cache_key']}:generation")
+    pipe.llen(snapshot['cache_key'])
+    generation, length = pipe.execute()
+    if (generation or b'').decode() != snapshot['generation'] or length < snapshot['count']:
+        return None
+    return snapshot
+
+
+def load_collection_snapshot(redis_client, snapshot_id, discogs_ids=None):
+    """
+    Loads the releases of a collection snapshot from the collection cache.
+
+    Args:
+        redis_client (redis.Redis): Redis client for the collection cache.
+        snapshot_id (str): Id of the snapshot.
+        discogs_ids (list, optional): Only return releases with these Discogs ids. Defaults to None (all releases).
+
+    Returns:
+        list[dict] or None: Release dictionaries with their position in the snapshot as 'index', in collection
+        order, or None if the snapshot has expired or the folder has been imported in full since.
+    """
+    snapshot = redis_client.hgetall(f"{COLLECTION_SNAPSHOT_PREFIX}{snapshot_id}")
+    if not snapshot:
+        return None
+
+    cache_key = snapshot[b'cache_key'].decode()
+    count = int(snapshot[b'count'])
+    if not count:
+        return []
+
+    pipe = redis_client.pipeline()
+    pipe.get(f"{cache_key}:generation")
+    # The releases shown are the oldest count releases, later additions are at the head of the list
+    pipe.lrange(cache_key, -count, -1)
+    generation, values = pipe.execute()
+    if (generation or b'') != snapshot[b'generation'] or len(values) != count:
+        return None
+
+    wanted = set(discogs_ids) if discogs_ids is not None else None
+    collection = []
+    for index, value in enumerate(values, start=1):
+        release = json.loads(value)
+        if wanted is None or release['discogs_id'] in wanted:
+            collection.append({'index': index, **release})
+    return collection
+
+
+def fetch_new_folder_releases(releases, redis_client, instances_key):
+    """
+    Fetches releases of a collection folder, most recently added first, until the first release
+    whose instance id is in the given cache set.
+
+    Args:
+        releases (discogs_client.models.PaginatedList): Releases of the folder, sorted by date added descending.
+        redis_client (redis.Redis): Redis client for the collection cache.
+        instances_key (str): Redis key of the set of cached instance ids.
+
+    Returns:
+        list[dict]: Release dictionaries without index of the releases that are not cached yet, most recently added first.
+    """
+    client = releases.client
+    releases.per_page = DISCOGS_PER_PAGE
+
+    new_releases = []
+    page = 1
+    while True:
+        data = client._get(releases._url_for_page(page))
+        items = data['releases']
+
+        pipe = redis_client.pipeline()
+        for item in items:
+            pipe.sismember(instances_key, item.get('instance_id'))
+        for item, known in zip(items, pipe.execute()):
+            if known:
+                return new_releases
+            new_releases.append(build_release(item))
+
+        if page >= data['pagination']['pages']:
+            return new_releases
+        page += 1
+
+
+def fetch_folder_releases(releases):
+    """
+    Fetches every page of a collection folder's releases, see iter_folder_pages.
+
+    Args:
+        releases (discogs_client.models.PaginatedList): Releases of a collection folder.
+
+    Returns:
+        list[dict]: Raw release items of the folder, in Discogs order.
+    """
+    return [item for items in iter_folder_pages(releases) for item in items]
+
+
+def iter_folder_pages(releases):
+    """
+    Yields every page of a collection folder's releases at the largest page size.
+    The first page gives the page count, the remaining pages are then requested in parallel.
+    The number of requests in flight is limited by DISCOGS_IMPORT_CONCURRENCY and by the
+    rate limit allowance Discogs reported for the first page. Pages are yielded in order as soon as
+    they arrive and only a few pages are requested ahead of the consumer.
+
+    Args:
+        releases (discogs_client.models.PaginatedList): Releases of a collection folder.
+
+    Yields:
+        list[dict]: Raw release items of each page, in Discogs order.
+    """
+    client = releases.client
+    releases.per_page = DISCOGS_PER_PAGE
+
+    first_page = client._get(releases._url_for_page(1))
+    pages = first_page['pagination']['pages']
+    yield first_page['releases']
+    if pages <= 1:
+        return
+
+    rate_limit_remaining = getattr(
+        client._fetcher, 'rate_limit_remaining', None)
+    workers = min(DISCOGS_IMPORT_CONCURRENCY, pages - 1)
+    if rate_limit_remaining is not None:
+        workers = max(1, min(workers, int(rate_limit_remaining)))
+
+    current_app.logger.debug(
+        "Fetching %d more pages of %d releases with %d workers", pages - 1, DISCOGS_PER_PAGE, workers)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            next_page = 2
+            while pending or next_page <= pages:
+                while next_page <= pages and len(pending) < workers * 2:
+                    pending.append(executor.submit(
+                        client._get, releases._url_for_page(next_page)))
+                    next_page += 1
+                yield pending.popleft().result()['releases']
+        finally:
+            # Stop requesting pages the consumer no longer wants
+            for future in pending:
+                future.cancel()
+
+
+def build_release(item):
+    """
+    Builds the release dictionary returned to the frontend from a raw Discogs collection item.
+    The position of the release in the collection ('index') is added by the caller.
+
+    Args:
+        item (dict): Collection item as returned by the Discogs API.
+
+    Returns:
+        dict: The release data.
+    """
+    basic_info = item.get('basic_information', {})
+    formats = basic_info.get('formats', [{}])[0]
+    artist = [sanitise_string(a.get('name'))
+              for a in basic_info.get('artists', [])]
+    discogs_id = basic_info.get('id')
+
+    return {
+        'artists': artist,
+        'title': basic_info.get('title'),
+        'year': basic_info.get('year'),
+        'discogs_id': discogs_id,
+        'cover': basic_info.get('thumb'),
+        'format': formats.get('name'),
+        'descriptions': formats.get('descriptions'),
+        'url': f"https://www.discogs.com/release/{discogs_id}",
+        'instance_id': item.get('instance_id')
+    }
+
+
 def sanitise_string(string):
     """
     Util function for removing unnecessary characters from string that Discogs adds
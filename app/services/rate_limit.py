@@ -0,0 +1,147 @@
+import logging
+import random
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Takes a token from the bucket if one is available. Returns 0 when the request may be sent, otherwise the
+# number of milliseconds to wait before asking again. The bucket is refilled with Redis server time, so the
+# clocks of the calling processes don't matter.
+#   KEYS[1]: bucket hash, KEYS[2]: pause key
+#   ARGV[1]: rate in tokens per second, ARGV[2]: bucket capacity
+_ACQUIRE_SCRIPT = """
+local pause = redis.call('PTTL', KEYS[2])
+if pause > 0 then
+    return pause
+end
+
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+if tokens == nil or updated == nil then
+    tokens = burst
+    updated = now
+end
+tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate / 1000)
+
+if tokens >= 1 then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'updated', now)
+    redis.call('HINCRBY', KEYS[1], 'granted', 1)
+    return 0
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', now)
+return math.ceil((1 - tokens) * 1000 / rate)
+"""
+
+
+class TokenBucket:
+    """
+    Request budget shared by every process that uses the same Redis key, e.g. all web and Celery worker
+    processes calling the same API. Tokens are added at a fixed rate up to the bucket's capacity and each
+    request takes one, so together the processes send requests at the rate with bursts of up to capacity.
+    A pause, set when the API answers with Retry-After, holds back all processes at once.
+    A rate of 0 disables the budget: requests are sent without a Redis round trip and a pause only holds
+    back the process that received the Retry-After.
+    """
+
+    def __init__(self, client, key, rate, burst=None, max_wait=60, jitter=0.05):
+        self.client = client
+        self.key = key
+        self.pause_key = f"{key}:pause"
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self._paused_until = 0
+        self._script = client.register_script(_ACQUIRE_SCRIPT)
+
+    def acquire(self):
+        """
+        Wait until a request may be sent. The limiter fails open: if Redis can't be reached, the request is allowed.
+
+        Returns:
+            bool: True once a token was taken, False if that would take longer than max_wait seconds.
+        """
+        if self.rate <= 0:
+            delay = self._paused_until - time.monotonic()
+            if delay > self.max_wait:
+                return False
+            if delay > 0:
+                time.sleep(delay)
+            return True
+
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            try:
+                wait_ms = self._script(
+                    keys=[self.key, self.pause_key], args=[self.rate, self.burst])
+            except redis.RedisError as e:
+                logger.warning(
+                    "Request budget %s unavailable, not limiting: %s", self.key, e)
+                return True
+
+            if not wait_ms:
+                return True
+
+            # Jitter keeps waiting processes from asking again all at the same moment
+            delay = wait_ms / 1000 + random.uniform(0, self.jitter)
+            if time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """
+        Hold back all processes for the given number of seconds, unless a longer pause is already set.
+
+        Args:
+            seconds (float): Pause duration, e.g. the Retry-After of a 429 response.
+        """
+        pause_ms = max(int(seconds * 1000), 1)
+        self._paused_until = max(self._paused_until, time.monotonic() + pause_ms / 1000)
+        try:
+            pipe = self.client.pipeline()
+            pipe.pttl(self.pause_key)
+            pipe.hincrby(self.key, 'rate_limited', 1)
+            current_ms = pipe.execute()[0]
+            if current_ms < pause_ms:
+                self.client.set(self.pause_key, 1, px=pause_ms)
+        except redis.RedisError as e:
+            logger.warning(
+                "Request budget %s unavailable, could not pause: %s", self.key, e)
+
+    def usage(self):
+        """
+        Read the current state of the budget.
+
+        Returns:
+            dict: 'rate' and 'burst' settings, 'available' tokens, 'paused_for' seconds left of a pause, and
+            the 'granted' (only counted while the budget is enabled) and 'rate_limited' (429 responses) counts
+            since the counters were created.
+        """
+        pipe = self.client.pipeline()
+        pipe.hgetall(self.key)
+        pipe.pttl(self.pause_key)
+        pipe.time()
+        data, pause_ms, (seconds, microseconds) = pipe.execute()
+        data = {field.decode(): float(value) for field, value in data.items()}
+
+        available = None
+        if self.rate > 0:
+            now = seconds * 1000 + microseconds // 1000
+            tokens = data.get('tokens', self.burst)
+            elapsed = max(now - data.get('updated', now), 0)
+            available = min(self.burst, tokens + elapsed * self.rate / 1000)
+
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'available': available,
+            'paused_for': max(pause_ms, 0) / 1000,
+            'granted': int(data.get('granted', 0)),
+            'rate_limited': int(data.get('rate_limited', 0)),
+        }
@@ -0,0 +1,203 @@
+import json
+import logging
+from datetime import timedelta
+
+import msgspec
+import redis
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY_PREFIX = "discofy:state:"
+SESSION_TTL = timedelta(days=3)
+
+# Number of attempts of an optimistic update before giving up
+SESSION_UPDATE_RETRIES = 5
+
+_encoder = msgspec.json.Encoder()
+_decoder = msgspec.json.Decoder()
+
+
+class SessionStore:
+    """
+    Stores user sessions as Redis hashes, one field per session entry (e.g. 'spotify_tokens').
+    Values are encoded with msgspec JSON, so requests read and write only the fields they use.
+    Sessions stored as a single JSON string by earlier versions are converted on first access.
+    """
+
+    def __init__(self, client, prefix=SESSION_KEY_PREFIX, ttl=SESSION_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def key(self, state):
+        """
+        Return the Redis key of the session with the given state.
+        """
+        return f"{self.prefix}{state}"
+
+    def get(self, state, *fields, touch=False):
+        """
+        Read fields of a session in a single round trip.
+
+        Args:
+            state (str): Session state identifier.
+            *fields (str): Fields to read. All fields are read if none are given.
+            touch (bool, optional): Also reset the session's expiry. Defaults to False.
+
+        Returns:
+            dict or None: The requested fields that are set, or None if the session does not exist.
+        """
+        try:
+            return self._get(state, fields, touch)
+        except redis.ResponseError as e:
+            if 'WRONGTYPE' not in str(e):
+                raise
+            self._migrate(state)
+            return self._get(state, fields, touch)
+
+    def _get(self, state, fields, touch):
+        key = self.key(state)
+        pipe = self.client.pipeline(transaction=False)
+        if fields:
+            pipe.hmget(key, fields)
+        else:
+            pipe.hgetall(key)
+        if touch:
+            pipe.expire(key, self.ttl)
+        else:
+            pipe.exists(key)
+        values, exists = pipe.execute()
+
+        if not exists:
+            return None
+        if fields:
+            values = zip(fields, values)
+        else:
+            values = ((field.decode(), value) for field, value in values.items())
+        return {field: _decoder.decode(value) for field, value in values if value is not None}
+
+    def create(self, state, data):
+        """
+        Create a session, replacing any existing session with the same state.
+
+        Args:
+            state (str): Session state identifier.
+            data (dict): Initial session fields.
+        """
+        key = self.key(state)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping=_encode_fields(data))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def set(self, state, data, remove=()):
+        """
+        Write fields of a session and reset its expiry in a single transaction.
+
+        Args:
+            state (str): Session state identifier.
+            data (dict): Fields to write.
+            remove (iterable, optional): Fields to delete. Defaults to none.
+        """
+        key = self.key(state)
+        pipe = self.client.pipeline()
+        self._write(pipe, key, data, remove)
+        try:
+            pipe.execute()
+        except redis.ResponseError as e:
+            if 'WRONGTYPE' not in str(e):
+                raise
+            self._migrate(state)
+            pipe = self.client.pipeline()
+            self._write(pipe, key, data, remove)
+            pipe.execute()
+
+    def _write(self, pipe, key, data, remove):
+        if data:
+            pipe.hset(key, mapping=_encode_fields(data))
+        if remove:
+            pipe.hdel(key, *remove)
+        pipe.expire(key, self.ttl)
+
+    def update(self, state, fields, func):
+        """
+        Read-modify-write of session fields with optimistic concurrency. The fields are read while the
+        session is watched and the changes returned by func are only written if the session was not
+        modified in the meantime, otherwise the update is retried with the new values. func can therefore
+        run several times and must not have side effects such as API requests.
+
+        Args:
+            state (str): Session state identifier.
+            fields (iterable): Fields passed to func.
+            func (callable): Receives the current fields as a dict (or None if the session does not exist)
+                and returns a dict of fields to write, or None to leave the session unchanged.
+
+        Returns:
+            dict or None: The session fields after the update, or None if the session does not exist.
+
+        Raises:
+            redis.WatchError: If the session kept changing for SESSION_UPDATE_RETRIES attempts.
+        """
+        key = self.key(state)
+        fields = list(fields)
+        self.get(state, *fields)  # converts a legacy session before it is watched
+
+        for _ in range(SESSION_UPDATE_RETRIES):
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    if not pipe.exists(key):
+                        func(None)
+                        return None
+                    values = pipe.hmget(key, fields)
+                    current = {field: _decoder.decode(value)
+                               for field, value in zip(fields, values) if value is not None}
+
+                    changes = func(dict(current))
+                    if not changes:
+                        return current
+
+                    pipe.multi()
+                    self._write(pipe, key, changes, ())
+                    pipe.execute()
+                    return {**current, **changes}
+                except redis.WatchError:
+                    logger.debug(
+                        "Session %s changed during update, retrying", key)
+
+        raise redis.WatchError(f"Session {key} kept changing during update")
+
+    def delete(self, state):
+        """
+        Delete a session.
+        """
+        self.client.delete(self.key(state))
+
+    def _migrate(self, state):
+        """
+        Convert a session stored as a JSON string into a hash, keeping its expiry.
+        """
+        key = self.key(state)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.type(key) != b'string':
+                    return
+                data = json.loads(pipe.get(key))
+                ttl = pipe.ttl(key)
+
+                pipe.multi()
+                pipe.delete(key)
+                if data:
+                    pipe.hset(key, mapping=_encode_fields(data))
+                    pipe.expire(key, ttl if ttl > 0 else self.ttl)
+                pipe.execute()
+                logger.info("Converted legacy session %s to a hash", key)
+            except redis.WatchError:
+                # Converted or removed by a concurrent request
+                pass
+
+
+def _encode_fields(data):
+    return {field: _encoder.encode(value) for field, value in data.items()}
@@ -1,131 +1,1125 @@
 import os
+import hashlib
 import re
 import logging
 import json
 import time
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 import redis
 import spotipy
-from rapidfuzz import fuzz
-from flask import current_app
+import urllib3
+import msgspec
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from .rate_limit import TokenBucket
+from .session_store import SessionStore
 
 logger = logging.getLogger(__name__)
 
+_result_encoder = msgspec.msgpack.Encoder()
+_result_decoder = msgspec.msgpack.Decoder()
+
 # Create Celery specific client for functions handled by Celery in background
 REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379')
 celery_redis_client = redis.Redis.from_url(REDIS_URL)
+celery_session_store = SessionStore(celery_redis_client)
+
+# Spotify endpoints, can be pointed at a local API emulator for load testing
+SPOTIFY_API_URL = os.environ.get(
+    'SPOTIFY_API_URL', 'https://api.spotify.com/v1/')
+SPOTIFY_ACCOUNTS_URL = os.environ.get(
+    'SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+# The authorization page is opened by the browser, so it can live on a different host
+SPOTIFY_AUTH_URL = os.environ.get(
+    'SPOTIFY_AUTH_URL', f"{SPOTIFY_ACCOUNTS_URL}/authorize")
+SPOTIFY_TOKEN_URL = f"{SPOTIFY_ACCOUNTS_URL}/api/token"
+
+client_id = os.getenv('SPOTIPY_CLIENT_ID')
+client_secret = os.getenv('SPOTIPY_CLIENT_SECRET')
+
+# Access tokens are refreshed when they expire within TOKEN_REFRESH_MARGIN seconds, or TASK_TOKEN_REFRESH_MARGIN
+# seconds for background tasks, so that no request of a long transfer is sent with an expiring token.
+# Only one refresh per session runs at a time, guarded by a Redis lock held for up to TOKEN_REFRESH_LOCK_TIMEOUT seconds.
+TOKEN_REFRESH_MARGIN = 60
+TASK_TOKEN_REFRESH_MARGIN = 300
+TOKEN_REFRESH_LOCK_TIMEOUT = 10
+TOKEN_REFRESH_LOCK_PREFIX = "discofy:token_refresh:"
+
+# Shared Discogs -> Spotify match cache, keyed by Discogs release id
+MATCH_CACHE_PREFIX = "discofy:match:"
+MATCH_CACHE_TTL = int(os.environ.get('MATCH_CACHE_TTL', 60 * 60 * 24 * 30))
+MATCH_CACHE_MISS_TTL = int(os.environ.get(
+    'MATCH_CACHE_MISS_TTL', 60 * 60 * 24))
+
+# Shared album -> track URI cache used when building playlists, keyed by Spotify album id.
+# Entries are evicted least recently used first once their total size exceeds ALBUM_TRACKS_CACHE_MAX_BYTES.
+ALBUM_TRACKS_CACHE_PREFIX = "discofy:album_tracks:"
+ALBUM_TRACKS_INDEX_KEY = "discofy:album_tracks_index"
+ALBUM_TRACKS_SIZES_KEY = "discofy:album_tracks_sizes"
+ALBUM_TRACKS_BYTES_KEY = "discofy:album_tracks_bytes"
+ALBUM_TRACKS_CACHE_TTL = int(os.environ.get(
+    'ALBUM_TRACKS_CACHE_TTL', 60 * 60 * 24 * 180))
+ALBUM_TRACKS_CACHE_MAX_BYTES = int(os.environ.get(
+    'ALBUM_TRACKS_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+ALBUM_TRACKS_EVICTION_BATCH = 100
+
+# Album sizes and the total are only changed by these scripts, so concurrent workers writing or evicting the
+# same albums can't make the total drift from the sizes hash.
+# Stores album entries and adds the difference to their previous sizes to the total, returns the new total.
+#   KEYS[1]: sizes hash, KEYS[2]: index, KEYS[3]: total bytes, KEYS[4...]: album entry keys
+#   ARGV[1]: entry TTL, ARGV[2]: index score, ARGV[3...]: album id and entry pairs in the order of the keys
+_CACHE_ALBUM_TRACKS_SCRIPT = """
+local added = 0
+for i = 4, #KEYS do
+    local album_id = ARGV[2 * i - 5]
+    local value = ARGV[2 * i - 4]
+    local previous = tonumber(redis.call('HGET', KEYS[1], album_id)) or 0
+    redis.call('SETEX', KEYS[i], ARGV[1], value)
+    redis.call('HSET', KEYS[1], album_id, #value)
+    redis.call('ZADD', KEYS[2], ARGV[2], album_id)
+    added = added + #value - previous
+end
+return redis.call('INCRBY', KEYS[3], added)
+"""
+
+# Removes album entries and subtracts their recorded sizes from the total, returns the new total.
+#   KEYS[1]: sizes hash, KEYS[2]: index, KEYS[3]: total bytes, KEYS[4...]: album entry keys
+#   ARGV[1...]: album ids in the order of the keys
+_EVICT_ALBUM_TRACKS_SCRIPT = """
+local freed = 0
+for i = 4, #KEYS do
+    freed = freed + (tonumber(redis.call('HGET', KEYS[1], ARGV[i - 3])) or 0)
+    redis.call('DEL', KEYS[i])
+    redis.call('HDEL', KEYS[1], ARGV[i - 3])
+    redis.call('ZREM', KEYS[2], ARGV[i - 3])
+end
+return redis.call('DECRBY', KEYS[3], freed)
+"""
+_cache_album_tracks_script = celery_redis_client.register_script(
+    _CACHE_ALBUM_TRACKS_SCRIPT)
+_evict_album_tracks_script = celery_redis_client.register_script(
+    _EVICT_ALBUM_TRACKS_SCRIPT)
+
+# Transfer and playlist progress keys expire PROGRESS_TTL seconds after their last update
+TRANSFER_PROGRESS_PREFIX = "discofy:progress:"
+PLAYLIST_PROGRESS_PREFIX = "discofy:playlist_progress:"
+PROGRESS_TTL = int(os.environ.get('PROGRESS_TTL', 60 * 60 * 24))
+
+# Identical transfer submissions of a user return the running or recently finished transfer for
+# TRANSFER_SUBMISSION_TTL seconds instead of starting a new one
+TRANSFER_SUBMISSION_PREFIX = "discofy:transfer_submission:"
+TRANSFER_SUBMISSION_TTL = int(os.environ.get(
+    'TRANSFER_SUBMISSION_TTL', 60 * 60))
+TRANSFER_SUBMISSION_RETRIES = 5
+# A transfer that has neither finished nor failed is only returned while it shows signs of life, i.e. it was
+# submitted or updated its progress within TRANSFER_STALE_AFTER seconds. Otherwise it is presumed lost, e.g.
+# to a worker crash or redeploy (its task then stays PENDING), and a new transfer is started.
+TRANSFER_STALE_AFTER = int(os.environ.get('TRANSFER_STALE_AFTER', 5 * 60))
+
+# Finished transfer results are stored msgpack encoded and zlib compressed in slices of TRANSFER_RESULT_SLICE_SIZE
+# items rather than as JSON in the Celery result backend, so a slice can be read without decoding the whole result
+TRANSFER_RESULT_SLICE_SIZE = 500
+TRANSFER_RESULT_TTL = int(os.environ.get(
+    'TRANSFER_RESULT_TTL', 60 * 60 * 24))
+TRANSFER_RESULT_COMPRESSION_LEVEL = 6
+# Once the result is stored, the items list read by incremental clients only needs to outlive their last poll
+TRANSFER_ITEMS_FINISHED_TTL = 300
+
+# Maximum number of Spotify searches in flight per transfer
+SPOTIFY_SEARCH_CONCURRENCY = int(
+    os.environ.get('SPOTIFY_SEARCH_CONCURRENCY', 8))
+
+# Minimum number of seconds between progress updates published by a transfer
+PROGRESS_PUBLISH_INTERVAL = float(
+    os.environ.get('PROGRESS_PUBLISH_INTERVAL', 0.5))
+
+# Number of album candidates requested and scored per search pass
+SPOTIFY_SEARCH_CANDIDATES = int(
+    os.environ.get('SPOTIFY_SEARCH_CANDIDATES', 5))
+
+# Several-albums endpoint batch size and number of batches in flight while building a playlist
+SPOTIFY_ALBUMS_BATCH_SIZE = 20
+SPOTIFY_ALBUMS_CONCURRENCY = int(
+    os.environ.get('SPOTIFY_ALBUMS_CONCURRENCY', 4))
+
+# Number of sanitized strings memoized per process
+SANITIZE_CACHE_SIZE = 65536
+
+# Shared HTTP connection pool used for all Spotify API and token requests
+SPOTIFY_CONNECT_TIMEOUT = float(
+    os.environ.get('SPOTIFY_CONNECT_TIMEOUT', 3.05))
+SPOTIFY_READ_TIMEOUT = float(os.environ.get('SPOTIFY_READ_TIMEOUT', 10))
+SPOTIFY_POOL_SIZE = int(os.environ.get(
+    'SPOTIFY_POOL_SIZE', max(10, SPOTIFY_SEARCH_CONCURRENCY)))
+SPOTIFY_CLIENT_CACHE_SIZE = 128
+
+# Spotify Web API budget shared by all web and worker processes through Redis: SPOTIFY_RATE_LIMIT requests
+# per second in bursts of up to SPOTIFY_RATE_BURST, 0 leaves the rate unlimited. A 429 response holds back
+# every process for its Retry-After and the request is retried up to SPOTIFY_RATE_LIMIT_RETRIES times.
+SPOTIFY_RATE_LIMIT = float(os.environ.get('SPOTIFY_RATE_LIMIT', 0))
+SPOTIFY_RATE_BURST = float(os.environ.get(
+    'SPOTIFY_RATE_BURST', max(SPOTIFY_RATE_LIMIT, 1)))
+SPOTIFY_RATE_LIMIT_MAX_WAIT = float(
+    os.environ.get('SPOTIFY_RATE_LIMIT_MAX_WAIT', 60))
+SPOTIFY_RATE_LIMIT_RETRIES = 3
+SPOTIFY_RATE_LIMIT_KEY = "discofy:spotify_budget"
+
+spotify_rate_limiter = TokenBucket(
+    celery_redis_client, SPOTIFY_RATE_LIMIT_KEY, SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST, SPOTIFY_RATE_LIMIT_MAX_WAIT)
+
+_http_session = None
+_http_session_pid = None
+_spotify_clients = OrderedDict()
+_client_lock = threading.Lock()
+
+
+class PooledSpotify(spotipy.Spotify):
+    """
+    Spotipy client bound to a single access token that sends its requests through the shared connection pool
+    and within the Spotify request budget shared by all processes.
+    """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prefix = SPOTIFY_API_URL
+
+    def _internal_call(self, method, url, payload, params):
+        for attempt in range(SPOTIFY_RATE_LIMIT_RETRIES + 1):
+            if not spotify_rate_limiter.acquire():
+                raise spotipy.SpotifyException(
+                    429, -1, f"{url}:\n Spotify request budget exhausted")
+            try:
+                # spotipy removes entries from params, so every attempt gets its own copy
+                return super()._internal_call(method, url, payload, dict(params))
+            except spotipy.SpotifyException as e:
+                if not is_rate_limited(e) or attempt == SPOTIFY_RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = parse_retry_after(e.headers)
+                logger.warning(
+                    "Spotify rate limit reached, pausing all requests for %.1f seconds", retry_after)
+                spotify_rate_limiter.pause(retry_after)
+
+    def __del__(self):
+        # The session is shared with every other client in the process, so it must stay open
+        pass
+
+
+def is_rate_limited(error):
+    """
+    Check whether a SpotifyException was caused by a 429 response. spotipy also reports running out of
+    retries for 5xx responses as a 429, but without response headers, and that must not pause other processes.
+    """
+    return error.http_status == 429 and bool(error.headers)
 
-def transfer_from_discogs(collection_items, access_token, progress_key=None):
+
+def parse_retry_after(headers, default=1):
     """
-    Attempts to find Spotify matches for a list of Discogs collection items.
-    Uses a multi-pass search. Applies fuzzy matching to verify results.
-    Updates progress in Redis if a progress_key is provided.
+    Return the number of seconds to wait given by the Retry-After header of a 429 response.
+
+    Args:
+        headers (Mapping or None): Response headers.
+        default (float, optional): Seconds to wait when the header is missing or invalid. Defaults to 1.
+
+    Returns:
+        float: Seconds to wait.
+    """
+    try:
+        return max(float(headers['Retry-After']), 0)
+    except (TypeError, KeyError, ValueError):
+        return default
+
+
+def get_http_session():
+    """
+    Return the process wide keep-alive requests session used for Spotify requests.
+    The session is rebuilt after a fork so Celery worker processes never share sockets with their parent.
+
+    Returns:
+        requests.Session: Session with a pooled adapter and the retry policy spotipy uses by default, except
+        that 429 responses are left to PooledSpotify so that every process honors their Retry-After.
+    """
+    global _http_session, _http_session_pid
+
+    with _client_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            retry = urllib3.Retry(
+                total=spotipy.Spotify.max_retries,
+                connect=None,
+                read=False,
+                allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                status=spotipy.Spotify.max_retries,
+                backoff_factor=0.3,
+                status_forcelist=[code for code in spotipy.Spotify.default_retry_codes if code != 429],
+                respect_retry_after_header=False)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4, pool_maxsize=SPOTIFY_POOL_SIZE, max_retries=retry)
+
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            _http_session = session
+            _http_session_pid = os.getpid()
+            _spotify_clients.clear()
+            logger.debug(
+                "Created Spotify HTTP session with pool size %d", SPOTIFY_POOL_SIZE)
+
+        return _http_session
+
+
+def get_spotify_client(access_token):
+    """
+    Return a Spotify client for the given access token that reuses the shared connection pool.
+    Clients are cached per access token, so a token is never sent on behalf of another user.
 
     Args:
-        collection_items (list): List of Discogs collection items (dicts with 'artists', 'title', 'discogs_id').
         access_token (str): Spotify access token for API requests.
-        progress_key (str, optional): Redis key for progress tracking. Defaults to None.
 
     Returns:
-        list: List of dicts containing matched (or unmatched) items with Spotify metadata and match status.
+        PooledSpotify: Authenticated Spotipy client.
+    """
+    session = get_http_session()
+
+    with _client_lock:
+        client = _spotify_clients.get(access_token)
+        if client is not None:
+            _spotify_clients.move_to_end(access_token)
+            return client
+
+        client = PooledSpotify(
+            auth=access_token,
+            requests_session=session,
+            requests_timeout=(SPOTIFY_CONNECT_TIMEOUT, SPOTIFY_READ_TIMEOUT))
+        _spotify_clients[access_token] = client
+        if len(_spotify_clients) > SPOTIFY_CLIENT_CACHE_SIZE:
+            _spotify_clients.popitem(last=False)
+
+    return client
+
+
+def request_spotify_token(spotify_token_url, token_data):
+    """
+    Send a request to the Spotify token endpoint through the shared connection pool.
+
+    Args:
+        spotify_token_url (str): Spotify token endpoint URL.
+        token_data (dict): Form data for the token request (grant type, code or refresh token, client credentials).
+
+    Returns:
+        dict: Decoded JSON response from the token endpoint.
+    """
+    response = get_http_session().post(
+        spotify_token_url, data=token_data,
+        timeout=(SPOTIFY_CONNECT_TIMEOUT, SPOTIFY_READ_TIMEOUT))
+    return response.json()
+
+
+class SessionToken:
+    """
+    Spotify access token of a stored session, for background tasks that can outlive a single token.
+    The token is kept in memory and refreshed through refresh_session_token once it is
+    within TASK_TOKEN_REFRESH_MARGIN seconds of expiring. Safe to share between threads.
     """
-    if not access_token:
-        logger.warning("Access token is missing.")
-        return []
 
-    export_items = []
+    def __init__(self, state, store=None):
+        self.state = state
+        self.store = store or celery_session_store
+        self._tokens = None
+        self._refresh_failed = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns:
+            str: A Spotify access token valid for at least TASK_TOKEN_REFRESH_MARGIN seconds, or if it could not be
+            refreshed, the current token until it expires.
+
+        Raises:
+            LookupError: If the session or its Spotify tokens no longer exist, e.g. after the user logged out,
+                or the token has expired and could not be refreshed.
+        """
+        with self._lock:
+            if self._tokens:
+                expires_in = self._tokens.get('expires_at', 0) - time.time()
+                # After a failed refresh the token is used until it expires instead of asking again for every request
+                if expires_in >= TASK_TOKEN_REFRESH_MARGIN or (self._refresh_failed and expires_in > 0):
+                    return self._tokens['access_token']
+
+            session_data = refresh_session_token(
+                self.store, self.state, margin=TASK_TOKEN_REFRESH_MARGIN)
+            if not session_data or 'spotify_tokens' not in session_data:
+                raise LookupError(
+                    f"Spotify tokens for session {self.store.key(self.state)} not found")
+
+            tokens = session_data['spotify_tokens']
+            expires_in = tokens.get('expires_at', 0) - time.time()
+            if expires_in <= 0:
+                raise LookupError(
+                    f"Spotify token for session {self.store.key(self.state)} has expired and could not be refreshed")
+            self._refresh_failed = expires_in < TASK_TOKEN_REFRESH_MARGIN
+            if self._refresh_failed:
+                logger.warning(
+                    "Could not refresh the Spotify token of session %s, using it for its remaining %d seconds",
+                    self.store.key(self.state), expires_in)
+            self._tokens = tokens
+            return self._tokens['access_token']
+
+
+def resolve_access_token(access_token):
+    """
+    Return the current access token for a plain token string or a SessionToken.
+    """
+    if isinstance(access_token, SessionToken):
+        return access_token.get()
+    return access_token
+
+
+def match_collection_items(collection_items, access_token, progress_key=None):
+    """
+    Find Spotify matches for a batch of Discogs collection items, either a whole collection or one chunk of it.
+    Progress is added to the counters under progress_key, which may be shared by several concurrent batches.
+
+    Args:
+        collection_items (list): List of Discogs collection items (dicts with 'artists', 'title', 'discogs_id').
+        access_token (str or SessionToken): Spotify access token for API requests.
+        progress_key (str, optional): Redis key for progress tracking. Defaults to None.
+
+    Returns:
+        list: List of dicts containing matched (or unmatched) items with Spotify metadata and match status,
+        in the same order as collection_items.
+    """
     total = len(collection_items)
+    export_items = [None] * total
+    cached_count = 0
+    pending = []
+
+    cached_matches = get_cached_matches(
+        [item['discogs_id'] for item in collection_items])
 
     for idx, item in enumerate(collection_items):
-        discogs_artist = item['artists'][0]
-        discogs_album = item['title']
         discogs_id = item['discogs_id']
+        cached = cached_matches.get(discogs_id)
+        if cached:
+            logger.debug("Using cached result for discogs_id: %s (found: %s, score: %s)",
+                         discogs_id, cached['album']['found'], cached['score'])
+            album_data = cached['album']
+            album_data['discogs_id'] = discogs_id
+            export_items[idx] = album_data
+            cached_count += 1
+        else:
+            pending.append(idx)
 
-        logger.info(
-            "[%d out of %d] - Handling collection item: '%s - %s'",
-            idx + 1, total, discogs_artist, discogs_album
-        )
+    logger.info("%d out of %d items served from match cache, searching for %d items",
+                cached_count, total, len(pending))
 
-        search_queries = [
-            f"{discogs_album} artist:{discogs_artist}",
-            f"album:{discogs_album}",
-            discogs_album
-        ]
-
-        album_data = {
-            "artist": None,
-            "title": None,
-            "image": None,
-            "url": None,
-            "id": None,
-            "uri": None,
-            "found": False,
-        }
-
-        for query_idx, search_query in enumerate(search_queries, start=1):
-            logger.debug("[Search pass %d]", query_idx)
-            search_result = search_spotify_albums(access_token, search_query)
-            if search_result:
-                found_artist = search_result.get('artist', '')
-                found_album = search_result.get('title', '')
-                logger.debug("Search returned: '%s - %s'",
-                             found_artist, found_album)
-                match, score = is_match(
-                    discogs_artist, discogs_album, found_artist, found_album)
-                if match:
-                    logger.info("Matched Discogs item %s - %s with Spotify result %s - %s. Match score: %d",
-                                discogs_artist, discogs_album, found_artist, found_album, score)
-                    album_data = search_result
-                    album_data['found'] = True
-                    break
+    # Celery task progress update
+    if progress_key and cached_count:
+        advance_transfer_progress(
+            progress_key, [item for item in export_items if item], cached_count)
 
-        if not album_data['found']:
-            logger.info("No match found for '%s - %s' (discogs_id: %s)",
-                        discogs_artist, discogs_album, discogs_id)
+    if pending:
+        # Completed items are buffered and flushed at most every PROGRESS_PUBLISH_INTERVAL seconds
+        unreported = []
+        last_report = time.monotonic()
 
-        album_data['discogs_id'] = discogs_id
-        export_items.append(album_data)
+        with ThreadPoolExecutor(max_workers=SPOTIFY_SEARCH_CONCURRENCY) as executor:
+            futures = {
+                executor.submit(match_collection_item, collection_items[idx], access_token): idx
+                for idx in pending
+            }
+            for completed, future in enumerate(as_completed(futures), start=cached_count + 1):
+                album_data = future.result()
+                export_items[futures[future]] = album_data
+                logger.info("[%d out of %d] - Handled collection item",
+                            completed, total)
+
+                # Celery task progress update
+                if progress_key:
+                    unreported.append(album_data)
+                    if time.monotonic() - last_report >= PROGRESS_PUBLISH_INTERVAL:
+                        advance_transfer_progress(progress_key, unreported)
+                        unreported = []
+                        last_report = time.monotonic()
+
+        if progress_key and unreported:
+            advance_transfer_progress(progress_key, unreported)
+
+    # Summary
+    matched_count = sum(1 for item in export_items if item.get('found'))
+    logger.info("Finished processing %d items. Matched: %d, Unmatched: %d, From cache: %d.",
+                total, matched_count, total - matched_count, cached_count)
 
-        # Celery task progress update
-        if progress_key:
-            progress = {'current': idx + 1, 'total': total}
-            celery_redis_client.set(progress_key, json.dumps(progress))
+    return export_items
 
-    # Final summary
-    matched_count = sum(1 for item in export_items if item.get('found'))
-    logger.info("Finished processing %d items. Matched: %d, Unmatched: %d.",
-                total, matched_count, total - matched_count)
 
-    # Final mark Celery task as finished
-    if progress_key:
-        celery_redis_client.set(progress_key, json.dumps({
-            'current': total,
-            'total': total,
-            'finished': True
-        }))
+def transfer_items_key(progress_key):
+    """
+    Return the Redis key of the list that collects a transfer's items as they complete.
+    """
+    return f"{progress_key}:items"
 
-    return export_items
 
+def transfer_submission_key(user, collection):
+    """
+    Return the deduplication key of a transfer submission, a hash of the user and the normalized collection.
+
+    Args:
+        user (str): Id of the user submitting the transfer.
+        collection (list or dict): Normalized description of the transferred items, see normalize_transfer_items.
+
+    Returns:
+        str: Redis key of the submission.
+    """
+    payload = json.dumps([user, collection], sort_keys=True, separators=(',', ':'))
+    return f"{TRANSFER_SUBMISSION_PREFIX}{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def normalize_transfer_items(collection_items):
+    """
+    Reduce collection items to the fields a transfer depends on, as a sorted list without duplicates,
+    so that the same set of items posted in a different order gives the same submission key.
+
+    Args:
+        collection_items (list): Discogs collection items (dicts with 'artists', 'title', 'discogs_id').
+
+    Returns:
+        list: Sorted [discogs_id, artists, title] entries.
+    """
+    entries = {json.dumps([item.get('discogs_id'), item.get('artists'), item.get('title')])
+               for item in collection_items}
+    return [json.loads(entry) for entry in sorted(entries)]
+
+
+def claim_transfer_submission(client, submission_key, submission, is_reusable):
+    """
+    Register a transfer submission under its deduplication key, unless an identical transfer has been
+    submitted within TRANSFER_SUBMISSION_TTL seconds and can be returned instead. The check and the
+    registration are one optimistic transaction, so of several concurrent identical submissions only
+    one is registered.
+
+    Args:
+        client (redis.Redis): Redis client to register with.
+        submission_key (str): Key returned by transfer_submission_key.
+        submission (dict): 'task_id' and 'progress_key' of the new transfer.
+        is_reusable (callable): Receives a previous submission and returns whether its transfer can be
+            returned, e.g. because it has not failed.
+
+    Returns:
+        dict or None: The previous submission to return instead, or None if the new submission was
+        registered and its transfer should be started.
+
+    Raises:
+        redis.WatchError: If the submission kept changing for TRANSFER_SUBMISSION_RETRIES attempts.
+    """
+    for _ in range(TRANSFER_SUBMISSION_RETRIES):
+        with client.pipeline() as pipe:
+            try:
+                pipe.watch(submission_key)
+                previous = pipe.get(submission_key)
+                if previous is not None:
+                    previous = json.loads(previous)
+                    if is_reusable(previous):
+                        return previous
+
+                pipe.multi()
+                pipe.set(submission_key, json.dumps(submission),
+                         ex=TRANSFER_SUBMISSION_TTL)
+                pipe.execute()
+                return None
+            except redis.WatchError:
+                logger.debug(
+                    "Transfer submission %s changed, retrying", submission_key)
+
+    raise redis.WatchError(
+        f"Transfer submission {submission_key} kept changing")
+
+
+def is_transfer_active(client, submission_key, progress_key):
+    """
+    Check whether a submitted transfer that has not reported a final state is finished or still alive.
+    The submission and progress keys are given their full TTL on every write, so their remaining TTL tells
+    how long ago they were last written.
+
+    Args:
+        client (redis.Redis): Redis client to read with.
+        submission_key (str): Key returned by transfer_submission_key.
+        progress_key (str): Redis key for progress tracking of the transfer.
+
+    Returns:
+        bool: True if the transfer has finished, or was submitted or made progress within TRANSFER_STALE_AFTER seconds.
+    """
+    pipe = client.pipeline(transaction=False)
+    pipe.ttl(submission_key)
+    pipe.ttl(progress_key)
+    pipe.hget(progress_key, 'finished')
+    submission_ttl, progress_ttl, finished = pipe.execute()
+
+    if finished:
+        return True
+    return (submission_ttl > TRANSFER_SUBMISSION_TTL - TRANSFER_STALE_AFTER
+            or progress_ttl > PROGRESS_TTL - TRANSFER_STALE_AFTER)
+
+
+def transfer_input_key(progress_key):
+    """
+    Return the Redis key of the list that holds the collection items of a transfer split into chunks.
+    """
+    return f"{progress_key}:input"
+
+
+def store_transfer_input(progress_key, collection_items):
+    """
+    Store the collection items of a transfer, so that its chunks can be given a range of items to read
+    instead of carrying the items in their task messages.
+
+    Args:
+        progress_key (str): Redis key for progress tracking.
+        collection_items (list): Discogs collection items of the whole transfer.
+    """
+    input_key = transfer_input_key(progress_key)
+    pipe = celery_redis_client.pipeline()
+    pipe.delete(input_key)
+    if collection_items:
+        pipe.rpush(input_key, *[json.dumps(item) for item in collection_items])
+    pipe.expire(input_key, PROGRESS_TTL)
+    pipe.execute()
+
+
+def read_transfer_input(progress_key, start, stop):
+    """
+    Read a range of the collection items stored with store_transfer_input.
+
+    Args:
+        progress_key (str): Redis key for progress tracking.
+        start (int): Position of the first item.
+        stop (int): Position after the last item.
+
+    Returns:
+        list: Collection item dicts.
+    """
+    values = celery_redis_client.lrange(
+        transfer_input_key(progress_key), start, stop - 1)
+    return [json.loads(value) for value in values]
+
+
+def transfer_events_channel(progress_key):
+    """
+    Return the Redis pub/sub channel on which a transfer announces progress updates.
+    """
+    return f"{progress_key}:events"
+
+
+def start_transfer_progress(progress_key, total):
+    """
+    Initialise the progress counters of a transfer. Progress is kept in a Redis hash so that
+    concurrent chunks of the same transfer can update it atomically.
+
+    Args:
+        progress_key (str): Redis key for progress tracking.
+        total (int): Number of items in the whole transfer.
+    """
+    pipe = celery_redis_client.pipeline()
+    pipe.delete(progress_key, transfer_items_key(progress_key))
+    pipe.hset(progress_key, mapping={'current': 0, 'total': total, 'cached': 0})
+    pipe.expire(progress_key, PROGRESS_TTL)
+    pipe.execute()
+
+
+def advance_transfer_progress(progress_key, items, cached=0):
+    """
+    Record handled items of a transfer. The items are appended to the transfer's partial result list
+    in completion order, the progress counters are increased and subscribers of the transfer's events
+    channel are notified, all in the same round trip. Both keys expire PROGRESS_TTL seconds after the last update.
+
+    Args:
+        progress_key (str): Redis key for progress tracking.
+        items (list): Matched or unmatched item dicts that have just been handled.
+        cached (int, optional): How many of them were served from the match cache. Defaults to 0.
+    """
+    pipe = celery_redis_client.pipeline()
+    pipe.rpush(transfer_items_key(progress_key),
+               *[json.dumps(item) for item in items])
+    pipe.hincrby(progress_key, 'current', len(items))
+    if cached:
+        pipe.hincrby(progress_key, 'cached', cached)
+    pipe.expire(progress_key, PROGRESS_TTL)
+    pipe.expire(transfer_items_key(progress_key), PROGRESS_TTL)
+    pipe.publish(transfer_events_channel(progress_key), 'progress')
+    pipe.execute()
+
+
+def finish_transfer_progress(progress_key):
+    """
+    Mark a transfer as finished. Its items list expires TRANSFER_ITEMS_FINISHED_TTL seconds later,
+    the complete result is read with read_transfer_result.
+
+    Args:
+        progress_key (str): Redis key for progress tracking.
+    """
+    total = celery_redis_client.hget(progress_key, 'total') or 0
+    pipe = celery_redis_client.pipeline()
+    pipe.hset(progress_key, mapping={
+        'current': total,
+        'finished': 1
+    })
+    pipe.expire(progress_key, PROGRESS_TTL)
+    pipe.expire(transfer_items_key(progress_key), TRANSFER_ITEMS_FINISHED_TTL)
+    pipe.publish(transfer_events_channel(progress_key), 'finished')
+    pipe.execute()
+
+
+def read_transfer_progress(client, progress_key):
+    """
+    Read the progress counters of a transfer.
+
+    Args:
+        client (redis.Redis): Redis client to read with.
+        progress_key (str): Redis key for progress tracking.
+
+    Returns:
+        dict or None: Progress with 'current', 'total' and 'cached' counts ('finished' is added once done),
+        or None if no progress has been recorded.
+    """
+    data = client.hgetall(progress_key)
+    if not data:
+        return None
+
+    data = {key.decode(): int(value) for key, value in data.items()}
+    progress = {
+        'current': data.get('current', 0),
+        'total': data.get('total', 0),
+        'cached': data.get('cached', 0),
+    }
+    if data.get('finished'):
+        progress['finished'] = True
+    return progress
+
+
+def read_transfer_items(client, progress_key, cursor=0):
+    """
+    Read the items a transfer has completed since the given cursor.
+
+    Args:
+        client (redis.Redis): Redis client to read with.
+        progress_key (str): Redis key for progress tracking.
+        cursor (int, optional): Number of items the caller has already received. Defaults to 0.
+
+    Returns:
+        list: Item dicts in completion order, starting at position cursor.
+    """
+    values = client.lrange(transfer_items_key(progress_key), cursor, -1)
+    return [json.loads(value) for value in values]
+
+
+def transfer_result_key(progress_key):
+    """
+    Return the Redis key of the list that holds a finished transfer's result slices.
+    """
+    return f"{progress_key}:result"
+
+
+def store_transfer_result(progress_key, export_items):
+    """
+    Store the result of a finished transfer in slices of TRANSFER_RESULT_SLICE_SIZE items, each msgpack encoded
+    and zlib compressed, expiring after TRANSFER_RESULT_TTL seconds. The returned summary is what the task
+    hands to the Celery result backend in place of the items.
+
+    Args:
+        progress_key (str): Redis key for progress tracking of the transfer.
+        export_items (list): Matched or unmatched item dicts in collection order.
+
+    Returns:
+        dict: Summary with the 'result_key' of the stored slices, the item 'count' and the 'matched' count.
+    """
+    result_key = transfer_result_key(progress_key)
+    pipe = celery_redis_client.pipeline()
+    pipe.delete(result_key)
+    for i in range(0, len(export_items), TRANSFER_RESULT_SLICE_SIZE):
+        pipe.rpush(result_key, zlib.compress(
+            _result_encoder.encode(export_items[i:i + TRANSFER_RESULT_SLICE_SIZE]),
+            TRANSFER_RESULT_COMPRESSION_LEVEL))
+    pipe.expire(result_key, TRANSFER_RESULT_TTL)
+    pipe.execute()
+
+    return {
+        'result_key': result_key,
+        'count': len(export_items),
+        'matched': sum(1 for item in export_items if item.get('found')),
+    }
+
+
+def read_transfer_result(client, summary, offset=0, limit=None):
+    """
+    Read items of a finished transfer result, decoding only the slices that overlap the requested range.
+
+    Args:
+        client (redis.Redis): Redis client to read with.
+        summary (dict or list): Result of the transfer task, a summary returned by store_transfer_result.
+            Results of tasks that returned the items directly are sliced as they are.
+        offset (int, optional): Index of the first item to return. Defaults to 0.
+        limit (int, optional): Maximum number of items to return. Defaults to all remaining items.
+
+    Returns:
+        list or None: Item dicts in collection order, or None if the stored result has expired.
+    """
+    if isinstance(summary, list):
+        return summary[offset:None if limit is None else offset + limit]
+
+    count = summary['count']
+    stop = count if limit is None else min(offset + limit, count)
+    if offset >= stop:
+        return []
+
+    first = offset // TRANSFER_RESULT_SLICE_SIZE
+    last = (stop - 1) // TRANSFER_RESULT_SLICE_SIZE
+    slices = client.lrange(summary['result_key'], first, last)
+    if len(slices) != last - first + 1:
+        return None
+
+    items = [item for data in slices for item in _result_decoder.decode(zlib.decompress(data))]
+    start = offset - first * TRANSFER_RESULT_SLICE_SIZE
+    return items[start:start + stop - offset]
+
+
+def start_playlist_progress(progress_key, albums_total):
+    """
+    Initialise the progress counters of a playlist creation.
+
+    Args:
+        progress_key (str): Redis key for progress tracking.
+        albums_total (int): Number of albums in the playlist.
+    """
+    pipe = celery_redis_client.pipeline()
+    pipe.delete(progress_key)
+    pipe.hset(progress_key, mapping={
+        'albums_resolved': 0,
+        'albums_failed': 0,
+        'albums_total': albums_total,
+        'tracks_added': 0,
+        'tracks_total': 0
+    })
+    pipe.expire(progress_key, PROGRESS_TTL)
+    pipe.execute()
+
+
+def advance_playlist_progress(progress_key, **increments):
+    """
+    Increase playlist creation progress counters, e.g. albums_resolved or tracks_added.
+    Does nothing when no progress key is given.
+
+    Args:
+        progress_key (str or None): Redis key for progress tracking.
+        **increments (int): Amount to add to each named counter.
+    """
+    if not progress_key:
+        return
+    pipe = celery_redis_client.pipeline()
+    for field, amount in increments.items():
+        pipe.hincrby(progress_key, field, amount)
+    pipe.expire(progress_key, PROGRESS_TTL)
+    pipe.execute()
+
+
+def set_playlist_progress(progress_key, **values):
+    """
+    Set playlist creation progress fields, e.g. tracks_total or finished.
+    Does nothing when no progress key is given.
+
+    Args:
+        progress_key (str or None): Redis key for progress tracking.
+        **values (int): Value of each named field.
+    """
+    if not progress_key:
+        return
+    pipe = celery_redis_client.pipeline()
+    pipe.hset(progress_key, mapping=values)
+    pipe.expire(progress_key, PROGRESS_TTL)
+    pipe.execute()
+
+
+def read_playlist_progress(client, progress_key):
+    """
+    Read the progress counters of a playlist creation.
+
+    Args:
+        client (redis.Redis): Redis client to read with.
+        progress_key (str): Redis key for progress tracking.
+
+    Returns:
+        dict or None: Progress with 'albums_resolved', 'albums_failed', 'albums_total', 'tracks_added' and
+        'tracks_total' counts ('finished' is added once done), or None if no progress has been recorded.
+    """
+    data = client.hgetall(progress_key)
+    if not data:
+        return None
+
+    data = {key.decode(): int(value) for key, value in data.items()}
+    progress = {field: data.get(field, 0) for field in (
+        'albums_resolved', 'albums_failed', 'albums_total', 'tracks_added', 'tracks_total')}
+    if data.get('finished'):
+        progress['finished'] = True
+    return progress
+
+
+def match_collection_item(item, access_token):
+    """
+    Find the Spotify album matching a single Discogs collection item.
+    Runs the search passes in order, each pass scores up to SPOTIFY_SEARCH_CANDIDATES results
+    with the is_match criteria and the search stops at the first pass that produces a match.
+    The outcome is stored in the shared match cache.
+
+    Args:
+        item (dict): Discogs collection item (dict with 'artists', 'title', 'discogs_id').
+        access_token (str or SessionToken): Spotify access token for API requests.
+
+    Returns:
+        dict: Spotify metadata for the matched album, or an unmatched placeholder, with 'discogs_id' set.
+    """
+    discogs_artist = item['artists'][0]
+    discogs_album = item['title']
+    discogs_id = item['discogs_id']
+
+    logger.info("Handling collection item: '%s - %s' (discogs_id: %s)",
+                discogs_artist, discogs_album, discogs_id)
+
+    search_queries = [
+        f"{discogs_album} artist:{discogs_artist}",
+        f"album:{discogs_album}",
+        discogs_album
+    ]
+
+    album_data = {
+        "artist": None,
+        "title": None,
+        "image": None,
+        "url": None,
+        "id": None,
+        "uri": None,
+        "found": False,
+    }
+    best_score = None
+    search_failed = False
+
+    token = resolve_access_token(access_token)
+    for query_idx, search_query in enumerate(search_queries, start=1):
+        logger.debug("[Search pass %d]", query_idx)
+        candidates = search_spotify_album_candidates(
+            token, search_query)
+        if candidates is None:
+            search_failed = True
+        elif candidates:
+            match_idx, score = select_best_match(
+                discogs_artist, discogs_album, candidates)
+            if match_idx is not None:
+                search_result = candidates[match_idx]
+                logger.info("Matched Discogs item %s - %s with Spotify result %s - %s (candidate %d of %d). Match score: %d",
+                            discogs_artist, discogs_album, search_result['artist'], search_result['title'],
+                            match_idx + 1, len(candidates), score)
+                album_data = search_result
+                best_score = score
+                break
+            if best_score is None or score > best_score:
+                best_score = score
+
+    if not album_data['found']:
+        logger.info("No match found for '%s - %s' (discogs_id: %s)",
+                    discogs_artist, discogs_album, discogs_id)
+
+    # Don't remember a miss that may have been caused by a failed request
+    if album_data['found'] or not search_failed:
+        cache_match(discogs_id, album_data, best_score)
+
+    album_data['discogs_id'] = discogs_id
+    return album_data
+
+
+def get_cached_matches(discogs_ids):
+    """
+    Look up previously resolved Discogs releases in the shared match cache using a single Redis round trip.
+
+    Args:
+        discogs_ids (list): Discogs release ids to look up.
 
-def search_spotify_albums(access_token, search_query, limit=1):
+    Returns:
+        dict: Mapping of discogs_id to cached entry dicts with 'album' (Spotify metadata) and 'score' keys.
     """
-    Search Spotify for albums using the given query string.
+    ids = [discogs_id for discogs_id in dict.fromkeys(discogs_ids)
+           if discogs_id is not None]
+    if not ids:
+        return {}
+
+    try:
+        values = celery_redis_client.mget(
+            [f"{MATCH_CACHE_PREFIX}{discogs_id}" for discogs_id in ids])
+    except redis.RedisError as e:
+        logger.warning("Match cache lookup failed: %s", e)
+        return {}
+
+    cached = {}
+    for discogs_id, value in zip(ids, values):
+        if value:
+            cached[discogs_id] = json.loads(value)
+
+    logger.debug("Match cache returned %d of %d releases",
+                 len(cached), len(ids))
+    return cached
+
+
+def cache_match(discogs_id, album_data, score):
+    """
+    Store the outcome of a Discogs release search in the shared match cache.
+    Negative results are kept for a shorter time so that new Spotify releases are picked up.
+
+    Args:
+        discogs_id (int): Discogs release id.
+        album_data (dict): Spotify album metadata, with 'found' set to False for unmatched releases.
+        score (float or None): Match score of the accepted (or best rejected) search result.
+    """
+    if discogs_id is None:
+        return
+
+    entry = {
+        'album': {key: value for key, value in album_data.items() if key != 'discogs_id'},
+        'score': score,
+    }
+    ttl = MATCH_CACHE_TTL if album_data['found'] else MATCH_CACHE_MISS_TTL
+
+    try:
+        celery_redis_client.setex(
+            f"{MATCH_CACHE_PREFIX}{discogs_id}", ttl, json.dumps(entry))
+    except redis.RedisError as e:
+        logger.warning(
+            "Failed to cache match for discogs_id %s: %s", discogs_id, e)
+
+
+def get_cached_album_tracks(album_ids):
+    """
+    Look up album track lists in the shared album cache using a single Redis round trip.
+    Hits are marked as recently used so that popular albums survive eviction.
+
+    Args:
+        album_ids (list): Spotify album ids to look up.
+
+    Returns:
+        dict: Mapping of album id to its ordered list of track URIs.
+    """
+    ids = list(dict.fromkeys(album_ids))
+    if not ids:
+        return {}
+
+    try:
+        values = celery_redis_client.mget(
+            [f"{ALBUM_TRACKS_CACHE_PREFIX}{album_id}" for album_id in ids])
+        cached = {}
+        for album_id, value in zip(ids, values):
+            if value:
+                cached[album_id] = [
+                    f"spotify:track:{track_id}" for track_id in value.decode().split(',')]
+
+        if cached:
+            now = time.time()
+            celery_redis_client.zadd(ALBUM_TRACKS_INDEX_KEY, {
+                album_id: now for album_id in cached}, xx=True)
+    except redis.RedisError as e:
+        logger.warning("Album tracks cache lookup failed: %s", e)
+        return {}
+
+    logger.debug("Album tracks cache returned %d of %d albums",
+                 len(cached), len(ids))
+    return cached
+
+
+def cache_album_tracks(album_tracks):
+    """
+    Store album track lists in the shared album cache and evict the least recently used
+    albums if the cache has grown past ALBUM_TRACKS_CACHE_MAX_BYTES.
+    Track URIs are stored as comma separated track ids to keep entries small.
+
+    Args:
+        album_tracks (dict): Mapping of album id to its ordered list of track URIs.
+    """
+    entries = {album_id: ','.join(uri.rsplit(':', 1)[-1] for uri in track_uris)
+               for album_id, track_uris in album_tracks.items() if track_uris}
+    if not entries:
+        return
+
+    try:
+        args = [ALBUM_TRACKS_CACHE_TTL, time.time()]
+        for album_id, value in entries.items():
+            args += [album_id, value]
+        total_bytes = _cache_album_tracks_script(
+            keys=[ALBUM_TRACKS_SIZES_KEY, ALBUM_TRACKS_INDEX_KEY, ALBUM_TRACKS_BYTES_KEY,
+                  *[f"{ALBUM_TRACKS_CACHE_PREFIX}{album_id}" for album_id in entries]],
+            args=args)
+    except redis.RedisError as e:
+        logger.warning("Failed to cache album tracks: %s", e)
+        return
+
+    if total_bytes > ALBUM_TRACKS_CACHE_MAX_BYTES:
+        evict_album_tracks(total_bytes)
+
+
+def evict_album_tracks(total_bytes):
+    """
+    Remove least recently used albums from the album cache until it is below ALBUM_TRACKS_CACHE_MAX_BYTES.
+    Only as many of the oldest albums as needed are removed, at most ALBUM_TRACKS_EVICTION_BATCH at a time.
+    Entries whose key has already expired are removed from the index on the way.
+
+    Args:
+        total_bytes (int): Current size of the cache in bytes.
+    """
+    evicted = 0
+    try:
+        while total_bytes > ALBUM_TRACKS_CACHE_MAX_BYTES:
+            oldest = [album_id.decode() for album_id in celery_redis_client.zrange(
+                ALBUM_TRACKS_INDEX_KEY, 0, ALBUM_TRACKS_EVICTION_BATCH - 1)]
+            if not oldest:
+                break
+            sizes = celery_redis_client.hmget(ALBUM_TRACKS_SIZES_KEY, oldest)
+
+            ids = []
+            excess = total_bytes - ALBUM_TRACKS_CACHE_MAX_BYTES
+            for album_id, size in zip(oldest, sizes):
+                ids.append(album_id)
+                excess -= int(size or 0)
+                if excess <= 0:
+                    break
+
+            total_bytes = _evict_album_tracks_script(
+                keys=[ALBUM_TRACKS_SIZES_KEY, ALBUM_TRACKS_INDEX_KEY, ALBUM_TRACKS_BYTES_KEY,
+                      *[f"{ALBUM_TRACKS_CACHE_PREFIX}{album_id}" for album_id in ids]],
+                args=ids)
+            evicted += len(ids)
+    except redis.RedisError as e:
+        logger.warning("Album tracks cache eviction failed: %s", e)
+
+    logger.debug("Evicted %d albums from the album tracks cache", evicted)
+
+
+def search_spotify_album_candidates(access_token, search_query, limit=SPOTIFY_SEARCH_CANDIDATES):
+    """
+    Search Spotify for albums using the given query string and return all results of the first page.
 
     Args:
         access_token (str): Spotify access token for API requests.
         search_query (str): Query string to search for albums.
-        limit (int, optional): Maximum number of results to return. Defaults to 1.
+        limit (int, optional): Maximum number of results to return. Defaults to SPOTIFY_SEARCH_CANDIDATES.
 
     Returns:
-        dict or bool: Metadata for the top match if found (dict), False if no items found, or None on error.
+        list or None: Album metadata dicts in Spotify's relevance order (empty if no items found), or None on error.
     """
     if not access_token:
         logger.warning("Access token is missing.")
-        return []
+        return None
 
-    spotify = spotipy.Spotify(auth=access_token)
+    spotify = get_spotify_client(access_token)
 
     try:
         logger.debug(
@@ -133,42 +1127,43 @@ def search_spotify_albums(access_token, search_query, limit=1):
         search_result = spotify.search(
             q=search_query, type='album', limit=limit)
 
-        items = search_result.get('albums', []).get('items')
-
-        if items:
-            logger.debug("Search returned %d items", len(items))
-            # return first result
-            album = items[0]
-            return {
-                "artist": album["artists"][0]["name"],
-                "title": album["name"],
-                "image": album["images"][0]["url"] if album["images"] else None,
-                "url": album["external_urls"]["spotify"],
-                "id": album["id"],
-                "uri": album["uri"],
-                "found": True,
-            }
+        items = search_result.get('albums', {}).get('items') or []
+        logger.debug("Search returned %d items", len(items))
 
-        else:
-            logger.debug(
-                "Search returned no items.")
-            return False
+        return [{
+            "artist": album["artists"][0]["name"],
+            "title": album["name"],
+            "image": album["images"][0]["url"] if album["images"] else None,
+            "url": album["external_urls"]["spotify"],
+            "id": album["id"],
+            "uri": album["uri"],
+            "found": True,
+        } for album in items if album]
 
     except Exception as e:
         logger.error(f"Spotify search failed: {e}")
     return None
 
 
+# Precompiled patterns used by sanitize
+BRACKETED_NUMBER_PATTERN = re.compile(r'\s*\(\d+\)')
+BRACKETED_TEXT_PATTERN = re.compile(r"[\(\[].*?[\)\]]")
+SPECIAL_CHARACTERS_PATTERN = re.compile(r'[^a-z0-9\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
 def sanitize(text):
     """
     Sanitize a string for comparison by lowercasing, removing bracketed numbers, special characters, and normalizing whitespace.
+    Results are memoized, as the same artist names and titles are compared many times.
     """
     text = text.lower()
-    text = re.sub(r'\s*\(\d+\)', '', text)  # Remove bracketed numbers like (7)
+    text = BRACKETED_NUMBER_PATTERN.sub('', text)  # Remove bracketed numbers like (7)
     # Remove anything in (...) or [...]
-    text = re.sub(r"[\(\[].*?[\)\]]", "", text)
-    text = re.sub(r'[^a-z0-9\s]', '', text)  # Strip special characters
-    text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
+    text = BRACKETED_TEXT_PATTERN.sub('', text)
+    text = SPECIAL_CHARACTERS_PATTERN.sub('', text)  # Strip special characters
+    text = WHITESPACE_PATTERN.sub(' ', text)  # Normalize whitespace
     return text.strip()
 
 
@@ -215,6 +1210,28 @@ def is_match(discogs_artist, discogs_album, spotify_artist, spotify_album, thres
     logger.debug(
         "Unsantised album title only comparison ratio: %s", title_ratio)
 
+    match, score = decide_match(
+        base_ratio, token_ratio, title_ratio, original_title_ratio, threshold)
+    if not match:
+        logger.debug(
+            "No comparison ratio returned a good match for '%s - %s'", discogs_album, discogs_artist)
+    return match, score
+
+
+def decide_match(base_ratio, token_ratio, title_ratio, original_title_ratio, threshold=85):
+    """
+    Apply the matching criteria to a set of precomputed comparison ratios.
+
+    Args:
+        base_ratio (float): Ratio of the sanitized 'artist album' strings.
+        token_ratio (float): Token set ratio of the sanitized 'artist album' strings.
+        title_ratio (float): Ratio of the sanitized album titles.
+        original_title_ratio (float): Ratio of the unsanitized album titles.
+        threshold (int, optional): Minimum similarity score for a match. Defaults to 85.
+
+    Returns:
+        tuple: (bool, float) where bool indicates if a match was found, and float is the match score.
+    """
     # Prioritize type of ratio based on criteria
     if base_ratio >= threshold:
         logger.debug(
@@ -233,119 +1250,299 @@ def is_match(discogs_artist, discogs_album, spotify_artist, spotify_album, thres
             "Found matching using unsanitised title string comparison ratio")
         return True, original_title_ratio
     else:
-        logger.debug(
-            "No comparison ratio returned a good match for '%s - %s'", discogs_album, discogs_artist)
         return False, base_ratio
 
 
-def create_playlist(playlist_items, name, access_token):
+def match_pairs(discogs_pairs, spotify_pairs, threshold=85):
+    """
+    Batch version of is_match for scoring large numbers of Discogs/Spotify pairs, e.g. when re-scoring past transfers.
+    Every string is sanitized once, and ratios are computed with score cutoffs and only as far as
+    needed to reach a decision. Decisions and scores are identical to is_match.
+
+    Args:
+        discogs_pairs (iterable): (artist, album) tuples from Discogs.
+        spotify_pairs (iterable): (artist, album) tuples from Spotify, aligned with discogs_pairs.
+        threshold (int, optional): Minimum similarity score for a match. Defaults to 85.
+
+    Returns:
+        list: (bool, float) tuples, one per pair, as returned by is_match.
+    """
+    results = []
+    for (discogs_artist, discogs_album), (spotify_artist, spotify_album) in zip(discogs_pairs, spotify_pairs):
+        d_album = sanitize(discogs_album)
+        s_album = sanitize(spotify_album)
+        combined_discogs = f"{sanitize(discogs_artist)} {d_album}"
+        combined_spotify = f"{sanitize(spotify_artist)} {s_album}"
+
+        # The base ratio is the score of a rejected pair, so it is always computed in full
+        base_ratio = fuzz.ratio(combined_discogs, combined_spotify)
+        if base_ratio >= threshold:
+            results.append((True, base_ratio))
+            continue
+
+        # All remaining criteria require a token ratio of at least 70
+        token_ratio = fuzz.token_set_ratio(
+            combined_discogs, combined_spotify, score_cutoff=70)
+        if token_ratio < 70:
+            results.append((False, base_ratio))
+        elif token_ratio > 92 and base_ratio >= 70:
+            results.append((True, token_ratio))
+        elif (title_ratio := fuzz.ratio(d_album, s_album, score_cutoff=85)) > 85:
+            results.append((True, title_ratio))
+        elif (original_title_ratio := fuzz.ratio(discogs_album, spotify_album, score_cutoff=85)) > 85:
+            results.append((True, original_title_ratio))
+        else:
+            results.append((False, base_ratio))
+
+    return results
+
+
+def select_best_match(discogs_artist, discogs_album, candidates, threshold=85):
+    """
+    Score several Spotify search results against a Discogs release in one batch and pick the best match.
+    Every ratio used by is_match is computed for all candidates at once with process.cdist,
+    then the is_match criteria are applied to each candidate.
+
+    Args:
+        discogs_artist (str): Artist name from Discogs.
+        discogs_album (str): Album title from Discogs.
+        candidates (list): Album metadata dicts returned by search_spotify_album_candidates.
+        threshold (int, optional): Minimum similarity score for a match. Defaults to 85.
+
+    Returns:
+        tuple: (int or None, float or None) index of the best matching candidate (None if no candidate matches)
+        and its match score (the best rejected score if no candidate matches, None if there are no candidates).
+    """
+    if not candidates:
+        return None, None
+
+    d_artist = sanitize(discogs_artist)
+    d_album = sanitize(discogs_album)
+    spotify_albums = [candidate.get('title') or '' for candidate in candidates]
+    s_albums = [sanitize(album) for album in spotify_albums]
+    combined_spotify = [
+        f"{sanitize(candidate.get('artist') or '')} {s_album}"
+        for candidate, s_album in zip(candidates, s_albums)
+    ]
+
+    def scores(query, choices, scorer):
+        return process.cdist([query], choices, scorer=scorer, dtype=np.float64)[0]
+
+    base_ratios = scores(f"{d_artist} {d_album}", combined_spotify, fuzz.ratio)
+    token_ratios = scores(f"{d_artist} {d_album}",
+                          combined_spotify, fuzz.token_set_ratio)
+    title_ratios = scores(d_album, s_albums, fuzz.ratio)
+    original_title_ratios = scores(discogs_album, spotify_albums, fuzz.ratio)
+
+    best_idx = None
+    best_score = None
+    best_rejected_score = None
+    for idx in range(len(candidates)):
+        match, score = decide_match(
+            base_ratios[idx], token_ratios[idx], title_ratios[idx], original_title_ratios[idx], threshold)
+        score = float(score)
+        if match and (best_score is None or score > best_score):
+            best_idx, best_score = idx, score
+        elif not match and (best_rejected_score is None or score > best_rejected_score):
+            best_rejected_score = score
+
+    logger.debug("Scored %d candidates for '%s - %s', best match index: %s",
+                 len(candidates), discogs_artist, discogs_album, best_idx)
+    if best_idx is None:
+        return None, best_rejected_score
+    return best_idx, best_score
+
+
+def create_playlist(playlist_items, name, access_token, progress_key=None):
     """
     Create a new Spotify playlist from a list of album items and add all tracks from those albums.
 
     Args:
         playlist_items (list): List of album dicts.
         name (str): Name for the new playlist.
-        access_token (str): Spotify access token for API requests.
+        access_token (str or SessionToken): Spotify access token for API requests.
+        progress_key (str, optional): Redis key for progress tracking of albums resolved and tracks added.
 
     Returns:
         str or bool: URL of the created playlist if successful, False otherwise.
     """
     if not access_token:
-        current_app.logger.error("Access token is missing.")
-        return
+        logger.error("Access token is missing.")
+        return False
 
     PLAYLIST_DESCRIPTION = "This is a playlist created from Discogs collection using Discofy"
-    spotify = spotipy.Spotify(auth=access_token)
-    user_id = spotify.current_user()["id"]
+
+    if progress_key:
+        start_playlist_progress(progress_key, len(playlist_items))
 
     try:
+        spotify = get_spotify_client(resolve_access_token(access_token))
+        user_id = spotify.current_user()["id"]
+
+        # Extract playlist track uris before creating the playlist, so no empty playlist is left behind
+        logger.debug("Fetching playlist track URIs")
+        playlist_track_uris = fetch_playlist_track_uris(
+            spotify, playlist_items, progress_key)
+        set_playlist_progress(
+            progress_key, tracks_total=len(playlist_track_uris))
+        if not playlist_track_uris:
+            logger.error(
+                "No tracks found for the %d albums of playlist '%s'", len(playlist_items), name)
+            return False
+
         # Create an empty playlist
-        current_app.logger.debug(
+        logger.debug(
             "Creating playlist with name: '%s' and description: '%s' for user id: %s", name, PLAYLIST_DESCRIPTION, user_id)
         playlist = spotify.user_playlist_create(
             user_id, name=name, public=True, description=PLAYLIST_DESCRIPTION
         )
 
-        # Extract playlist track uris
-        current_app.logger.debug("Fetching playlist track URIs")
-        playlist_track_uris = fetch_playlist_track_uris(
-            spotify, playlist_items)
-
         # Add tracks to the playlist in batches (max 100 tracks supported in one request)
-        current_app.logger.debug(
+        logger.debug(
             "Adding %d tracks to playlist '%s'", len(playlist_track_uris), name)
         batch_counter = 1
         for i in range(0, len(playlist_track_uris), 100):
             min_track = i + 1
             max_track = i + 100 if i + \
                 100 < len(playlist_track_uris) else len(playlist_track_uris)
-            current_app.logger.debug(
+            logger.debug(
                 "Batch %d: adding tracks index %d to %d", batch_counter, min_track, max_track)
             batch = playlist_track_uris[i:i+100]
+            spotify = get_spotify_client(resolve_access_token(access_token))
             spotify.playlist_add_items(playlist["id"], batch)
+            advance_playlist_progress(progress_key, tracks_added=len(batch))
             batch_counter = batch_counter + 1
 
         playlist_url = playlist["external_urls"]["spotify"]
-        current_app.logger.info(
+        logger.info(
             "Successfully created playlist: '%s', with %d tracks in %d albums with url: '%s'", name, len(playlist_track_uris), len(playlist_items), playlist_url)
 
         return playlist_url
 
     except Exception as e:
-        current_app.logger.error(f"Error creating playlist: {e}")
+        logger.error(f"Error creating playlist: {e}")
         return False
 
+    finally:
+        set_playlist_progress(progress_key, finished=1)
 
-def fetch_playlist_track_uris(spotify, playlist_items):
+
+def fetch_playlist_track_uris(spotify, playlist_items, progress_key=None):
     """
     Fetch all track URIs from a list of Spotify album items.
+    Track lists are read from the shared album cache first. Remaining albums are resolved in batches of
+    SPOTIFY_ALBUMS_BATCH_SIZE with the several-albums endpoint, with up to SPOTIFY_ALBUMS_CONCURRENCY
+    batches in flight, and added to the cache. Further track pages are only requested for albums
+    with more tracks than fit in the first page.
 
     Args:
         spotify (spotipy.Spotify): Authenticated Spotipy client.
         playlist_items (list): List of album dicts with Spotify URIs.
+        progress_key (str, optional): Redis key for progress tracking, albums_resolved is increased per batch
+            and albums_failed by the albums of failed batches, both per playlist item.
 
     Returns:
-        list: List of track URIs from all albums, or an empty list on error.
+        list: List of track URIs from all albums, in album order. Albums whose batch failed are left out.
     """
-    playlist_track_uris = []
-    try:
-        for album in playlist_items:
-            album_uri = album["uri"]
-            tracks = spotify.album_tracks(album_uri)["items"]
-            album_track_uris = [track["uri"] for track in tracks]
-            playlist_track_uris.extend(album_track_uris)
+    album_ids = [album["uri"].rsplit(':', 1)[-1] for album in playlist_items]
+    # albums_total counts every playlist item, so albums are counted per occurrence when resolved
+    occurrences = Counter(album_ids)
+    cached = get_cached_album_tracks(album_ids)
+    advance_playlist_progress(progress_key, albums_resolved=sum(
+        1 for album_id in album_ids if album_id in cached))
+
+    missing_ids = [album_id for album_id in dict.fromkeys(album_ids)
+                   if album_id not in cached]
+    batches = [missing_ids[i:i + SPOTIFY_ALBUMS_BATCH_SIZE]
+               for i in range(0, len(missing_ids), SPOTIFY_ALBUMS_BATCH_SIZE)]
+
+    # A failed batch only loses its own albums, the tracks of all other batches are still cached and returned
+    fetched = {}
+    failed_ids = []
+    with ThreadPoolExecutor(max_workers=SPOTIFY_ALBUMS_CONCURRENCY) as executor:
+        futures = {executor.submit(fetch_album_batch_track_uris, spotify, batch): batch
+                   for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                fetched.update(zip(batch, future.result()))
+            except Exception as e:
+                logger.warning("Failed to fetch tracks of albums %s: %s",
+                               ', '.join(batch), e)
+                failed_ids.extend(batch)
+                continue
+            advance_playlist_progress(progress_key, albums_resolved=sum(
+                occurrences[album_id] for album_id in batch))
+
+    if failed_ids:
+        logger.warning("Tracks of %d of %d albums could not be fetched",
+                       len(failed_ids), len(occurrences))
+        advance_playlist_progress(progress_key, albums_failed=sum(
+            occurrences[album_id] for album_id in failed_ids))
+    cache_album_tracks(fetched)
+
+    album_tracks = {**cached, **fetched}
+    return [uri for album_id in album_ids for uri in album_tracks.get(album_id, [])]
+
+
+def fetch_album_batch_track_uris(spotify, album_uris):
+    """
+    Fetch the track URIs of up to SPOTIFY_ALBUMS_BATCH_SIZE albums with a single several-albums request,
+    following track pagination for long albums.
 
-        return playlist_track_uris
+    Args:
+        spotify (spotipy.Spotify): Authenticated Spotipy client.
+        album_uris (list): Spotify album URIs or IDs.
 
-    except Exception as e:
-        current_app.logger.warning(
-            f"Failed to fetch tracks for album {album_uri}: {e}")
-        return []
+    Returns:
+        list: One list of track URIs per requested album, in request order.
+    """
+    albums = spotify.albums(album_uris)["albums"]
+
+    album_track_uris = []
+    for album_uri, album in zip(album_uris, albums):
+        if not album:
+            logger.warning("Album %s not found on Spotify", album_uri)
+            album_track_uris.append([])
+            continue
+
+        tracks = album["tracks"]
+        track_uris = [track["uri"] for track in tracks["items"]]
+        while tracks.get("next"):
+            logger.debug("Fetching next page of tracks for album %s", album_uri)
+            tracks = spotify.next(tracks)
+            track_uris.extend(track["uri"] for track in tracks["items"])
+
+        album_track_uris.append(track_uris)
+
+    return album_track_uris
 
 
-def check_token_expiry(session_data, spotify_token_url):
+def check_token_expiry(session_data, spotify_token_url, margin=TOKEN_REFRESH_MARGIN):
     """
     Check if the Spotify access token in session data is about to expire and refresh it if needed.
     Updates the session data in-place with new token info if refreshed.
+    Does not store the session, use refresh_session_token to refresh a stored session.
 
     Args:
         session_data (dict): Session data containing 'spotify_tokens'.
         spotify_token_url (str): Spotify token endpoint URL for refreshing tokens.
+        margin (int, optional): Refresh tokens expiring within this many seconds. Defaults to TOKEN_REFRESH_MARGIN.
 
     Returns:
         dict: Updated session data with refreshed tokens if applicable, otherwise returns unchanged session data.
     """
     if 'spotify_tokens' not in session_data:
-        current_app.logger.warning("Spotify tokens not found in session data")
+        logger.warning("Spotify tokens not found in session data")
         return session_data
 
     current_time = int(time.time())
 
-    # Check if the token expires in the next 60 seconds
+    # Check if the token expires within the margin
     token_expires_in = session_data['spotify_tokens'].get(
         'expires_at', 0) - current_time
-    if token_expires_in < 60:
-        current_app.logger.warning(
+    if token_expires_in < margin:
+        logger.warning(
             "Spotify token expires in %d seconds. Refreshing the token", token_expires_in)
         try:
             # Refreshing the token
@@ -355,12 +1552,12 @@ def check_token_expiry(session_data, spotify_token_url):
             token_data = {
                 'grant_type': 'refresh_token',
                 'refresh_token': refresh_token,
-                'client_id': current_app.config.get('SPOTIFY_CLIENT_ID'),
-                'client_secret': current_app.config.get('SPOTIFY_CLIENT_SECRET'),
+                'client_id': client_id,
+                'client_secret': client_secret,
             }
 
-            response = requests.post(spotify_token_url, data=token_data)
-            new_token_info = response.json()
+            new_token_info = request_spotify_token(
+                spotify_token_url, token_data)
 
             # Add expiration time
             new_token_info['expires_at'] = int(
@@ -372,11 +1569,81 @@ def check_token_expiry(session_data, spotify_token_url):
 
             # Update session with new tokens
             session_data['spotify_tokens'] = new_token_info
-            current_app.logger.info(
+            logger.info(
                 "New token generated. Expires at: %s", new_token_info['expires_at'])
 
         except Exception as e:
-            current_app.logger.error(
+            logger.error(
                 "Error refreshing token: %s", e, exc_info=True)
 
     return session_data
+
+
+def token_expires_within(session_data, margin):
+    """
+    Check if the Spotify access token in session data expires within the given number of seconds.
+    """
+    return session_data['spotify_tokens'].get('expires_at', 0) - time.time() < margin
+
+
+def refresh_session_token(store, state, session_data=None, margin=TOKEN_REFRESH_MARGIN):
+    """
+    Refresh the Spotify access token of a stored session if it expires within margin seconds.
+
+    Refreshes are single-flight: the request that takes the session's refresh lock refreshes and
+    stores the token, concurrent callers wait for the lock and then read the stored result,
+    so a session's refresh token is only used once however many requests and tasks need it.
+
+    Args:
+        store (SessionStore): Session store holding the session.
+        state (str): Session state identifier.
+        session_data (dict, optional): Session fields already read by the caller, including 'spotify_tokens'.
+            Defaults to None (read them).
+        margin (int, optional): Refresh tokens expiring within this many seconds. Defaults to TOKEN_REFRESH_MARGIN.
+
+    Returns:
+        dict or None: Session fields with a token valid for at least margin seconds if it could be refreshed,
+        or None if the session does not exist.
+    """
+    if session_data is None:
+        session_data = store.get(state, 'spotify_tokens')
+    if not session_data or 'spotify_tokens' not in session_data:
+        return session_data
+    if not token_expires_within(session_data, margin):
+        return session_data
+
+    session_key = store.key(state)
+    lock = store.client.lock(f"{TOKEN_REFRESH_LOCK_PREFIX}{state}",
+                             timeout=TOKEN_REFRESH_LOCK_TIMEOUT, blocking_timeout=TOKEN_REFRESH_LOCK_TIMEOUT)
+    if not lock.acquire():
+        logger.warning(
+            "Timed out waiting for the token refresh of session %s", session_key)
+        return session_data
+
+    try:
+        # Another request may have refreshed the token while this one waited for the lock
+        current = store.get(state, 'spotify_tokens')
+        if current is None:
+            return None
+        if 'spotify_tokens' not in current or not token_expires_within(current, margin):
+            logger.debug(
+                "Using token refreshed by a concurrent request for session %s", session_key)
+            return {**session_data, **current}
+
+        # The token endpoint is called exactly once while the lock is held, only the write below is retried
+        access_token = current['spotify_tokens'].get('access_token')
+        current = check_token_expiry(current, SPOTIFY_TOKEN_URL, margin)
+        if current['spotify_tokens'].get('access_token') == access_token:
+            return {**session_data, **current}
+
+        changes = {'spotify_tokens': current['spotify_tokens']}
+        # Don't bring back a session that was removed (e.g. by a logout) during the refresh
+        updated = store.update(
+            state, ['spotify_tokens'], lambda stored: changes if stored is not None else None)
+        return {**session_data, **updated} if updated is not None else None
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            logger.warning(
+                "Token refresh lock of session %s expired before the refresh finished", session_key)
@@ -0,0 +1,68 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Number of keys requested per SCAN call, each batch is checked with one pipelined round trip
+SWEEP_SCAN_COUNT = int(os.environ.get('SWEEP_SCAN_COUNT', 500))
+
+
+def sweep_keys(client, pattern, ttl=None, scan_count=SWEEP_SCAN_COUNT):
+    """
+    Incrementally walk the keys matching pattern with SCAN and handle those that have no expiry.
+    Unlike KEYS, SCAN never blocks the server for long, and the TTLs of each batch are read in a single
+    pipelined round trip rather than one call per key.
+
+    Args:
+        client (redis.Redis): Redis client to sweep with.
+        pattern (str): Glob-style pattern of the keys to check, e.g. 'discofy:state:*'.
+        ttl (int, optional): Expiry in seconds given to keys without one. Keys without expiry are deleted
+            when not set. Defaults to None.
+        scan_count (int, optional): Number of keys requested per SCAN call. Defaults to SWEEP_SCAN_COUNT.
+
+    Returns:
+        int: Number of keys deleted or given an expiry.
+    """
+    count = 0
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor, match=pattern, count=scan_count)
+        if keys:
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.ttl(key)
+            # -1 means the key exists without expiry, -2 that it is already gone
+            stale = [key for key, key_ttl in zip(keys, pipe.execute()) if key_ttl == -1]
+
+            if stale:
+                pipe = client.pipeline(transaction=False)
+                for key in stale:
+                    if ttl is None:
+                        pipe.delete(key)
+                    else:
+                        pipe.expire(key, ttl)
+                pipe.execute()
+                count += len(stale)
+
+        if cursor == 0:
+            break
+
+    logger.debug("Swept %d keys matching %s", count, pattern)
+    return count
+
+
+def sweep_redis(client, rules, scan_count=SWEEP_SCAN_COUNT):
+    """
+    Sweep several key patterns, see sweep_keys.
+
+    Args:
+        client (redis.Redis): Redis client to sweep with.
+        rules (iterable): (pattern, ttl) pairs, a ttl of None deletes keys without expiry.
+        scan_count (int, optional): Number of keys requested per SCAN call. Defaults to SWEEP_SCAN_COUNT.
+
+    Returns:
+        dict: Number of keys swept per pattern.
+    """
+    swept = {pattern: sweep_keys(client, pattern, ttl, scan_count) for pattern, ttl in rules}
+    logger.info("Redis sweep finished: %s", swept)
+    return swept
@@ -1,24 +1,42 @@
+import os
 import json
 import uuid
 import time
+import threading
 from datetime import timedelta
 
-from flask import jsonify, request, redirect, url_for, current_app
+from flask import jsonify, request, redirect, url_for, current_app, Response, stream_with_context
 
-import requests
-import spotipy
 from spotipy.oauth2 import SpotifyOAuth
+from celery import states
 from celery.result import AsyncResult
 from bleach import clean
 
-from ..services import spotify
-from ..extensions import redis_client
+from ..services import spotify, discogs
+from ..extensions import redis_client, session_store
 from . import spotify_bp
-from app.services.celery_tasks import celery, transfer_collection_task
+from app.services.celery_tasks import celery, transfer_collection_task, create_playlist_task
 
 # Spotify OAuth URLs
-SPOTIFY_AUTH_URL = "https://accounts.spotify.com/authorize"
-SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+SPOTIFY_AUTH_URL = spotify.SPOTIFY_AUTH_URL
+SPOTIFY_TOKEN_URL = spotify.SPOTIFY_TOKEN_URL
+
+# Number of seconds the Spotify user profile is cached in the session
+PROFILE_CACHE_TTL = 300
+
+# Transfer event stream settings (in seconds)
+EVENTS_HEARTBEAT_INTERVAL = 15
+# Every open stream holds a web server thread, so streams are closed after two heartbeats and clients reconnect
+# with their cursor (EventSource does so by itself, the cursor is sent as the event id)
+EVENTS_MAX_DURATION = 30
+# At most EVENTS_MAX_STREAMS streams are held open per web server process, so that streams can't take every
+# thread from the other endpoints. Keep it below the number of gunicorn threads per worker.
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 4))
+# A transfer marks its progress finished just before its task returns, the stream waits this long
+# for the task to reach its final state before reporting it
+EVENTS_FINAL_STATE_WAIT = 5
+
+event_stream_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
 
 
 @spotify_bp.route('/transfer_collection', methods=['POST'])
@@ -26,41 +44,97 @@ def transfer_collection():
     data = request.get_json()
     spotify_state = request.cookies.get('spotify_state')
     collection_items = data.get('collection')
-
-    if not spotify_state or not collection_items:
+    # A snapshot of the imported collection can be transferred instead of posting its items,
+    # optionally limited to a selection of Discogs ids
+    snapshot_id = data.get('snapshot_id')
+    discogs_ids = data.get('discogs_ids')
+    # Start a new transfer even if an identical one was submitted recently
+    force = bool(data.get('force'))
+
+    if not spotify_state or not (collection_items or snapshot_id):
         current_app.logger.error("Missing state or collection items")
         return jsonify({"error": "Missing state or collection items."}), 400
 
+    if discogs_ids is not None and not (isinstance(discogs_ids, list)
+                                        and all(isinstance(discogs_id, int) for discogs_id in discogs_ids)):
+        current_app.logger.error("Invalid discogs_ids: %s", discogs_ids)
+        return jsonify({"error": "discogs_ids must be a list of integers."}), 400
+
     # Get the redis session with the state key
-    session_key = f"discofy:state:{spotify_state}"
-    session_data = redis_client.get(session_key)
+    session_key = session_store.key(spotify_state)
+    session_data = session_store.get(
+        spotify_state, 'spotify_tokens', 'spotify_profile')
 
-    if not session_data:
+    if session_data is None:
         current_app.logger.error(
             "Requested session key: %s not found in Redis. Session not authorized.", session_key)
         return jsonify({"error": "Unauthorized or expired session"}), 401
 
-    session_data = json.loads(session_data)
-
     if 'spotify_tokens' not in session_data or 'access_token' not in session_data.get('spotify_tokens', {}):
         current_app.logger.error(
             "Session tokens not found in session data for session key: %s", session_key)
         return jsonify({"error": "Unauthorized or incomplete Spotify session"}), 401
 
-    access_token = session_data['spotify_tokens']['access_token']
+    if snapshot_id:
+        snapshot = discogs.current_collection_snapshot(
+            redis_client, snapshot_id)
+        if snapshot is None:
+            current_app.logger.error(
+                "Collection snapshot %s not found or outdated", snapshot_id)
+            return jsonify({"error": "Collection snapshot not found or outdated, reload the collection."}), 404
+        # Snapshots of the same cached releases describe the same items
+        collection = {**snapshot, 'discogs_ids': None if discogs_ids is None else sorted(set(discogs_ids))}
+    else:
+        collection = spotify.normalize_transfer_items(collection_items)
+
+    # Identical submissions of the same user (double clicks, reloads, several tabs) share one transfer
+    user = session_data.get('spotify_profile', {}).get('id', spotify_state)
+    submission_key = spotify.transfer_submission_key(user, collection)
+    submission = {
+        "task_id": str(uuid.uuid4()),
+        "progress_key": f"{spotify.TRANSFER_PROGRESS_PREFIX}{uuid.uuid4()}"
+    }
 
-    # Generate a unique progress key for this task
-    progress_key = f"discofy:progress:{uuid.uuid4()}"
+    def is_reusable(previous):
+        state = AsyncResult(previous['task_id'], app=celery).state
+        if state == states.SUCCESS:
+            return True
+        if state in (states.FAILURE, states.REVOKED):
+            return False
+        # A task lost to a worker crash stays PENDING, only return it while it is still making progress
+        return spotify.is_transfer_active(redis_client, submission_key, previous['progress_key'])
+
+    if force:
+        redis_client.delete(submission_key)
+    previous = spotify.claim_transfer_submission(
+        redis_client, submission_key, submission, is_reusable)
+    if previous is not None:
+        current_app.logger.info(
+            "Returning transfer %s for a duplicate submission", previous['task_id'])
+        return jsonify({**previous, "duplicate": True})
 
-    # Start the Celery task
-    task = transfer_collection_task.apply_async(
-        args=[collection_items, access_token, progress_key])
+    # Start the Celery task, it reads and refreshes the Spotify token through the session state
+    progress_key = submission['progress_key']
+    try:
+        if snapshot_id:
+            task = transfer_collection_task.apply_async(
+                args=[None, spotify_state, progress_key],
+                kwargs={'snapshot_id': snapshot_id, 'discogs_ids': discogs_ids},
+                task_id=submission['task_id'])
+        else:
+            task = transfer_collection_task.apply_async(
+                args=[collection_items, spotify_state, progress_key],
+                task_id=submission['task_id'])
+    except Exception:
+        redis_client.delete(submission_key)
+        raise
     current_app.logger.debug(
         "Delegated task to Celery with task id: %s and progress key: %s", task.id, progress_key)
 
     return jsonify({
         "task_id": task.id,
-        "progress_key": progress_key
+        "progress_key": progress_key,
+        "duplicate": False
     })
 
 
@@ -68,14 +142,18 @@ def transfer_collection():
 def transfer_collection_status():
     progress_key = request.args.get('progress_key')
     task_id = request.args.get('task_id')
+    # Optional number of items already received, enables incremental results
+    cursor = request.args.get('cursor', type=int)
+    # Optional slice of the finished result
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
     if not progress_key or not task_id:
         current_app.logger.error("Missing progress key or task id")
         return jsonify({"error": "Missing progress_key or task_id"}), 400
 
     # Get progress from Redis
-    progress = redis_client.get(progress_key)
+    progress = spotify.read_transfer_progress(redis_client, progress_key)
     if progress:
-        progress = json.loads(progress)
         current_app.logger.debug(
             "Task %s progress: %s", task_id, progress)
     else:
@@ -86,16 +164,142 @@ def transfer_collection_status():
     # Get task state
     task = AsyncResult(task_id, app=celery)
     state = task.state
-    result = task.result if task.state == 'SUCCESS' else None
-    current_app.logger.debug("Task %s state: %s", task_id, task.state)
+    current_app.logger.debug("Task %s state: %s", task_id, state)
+
+    if cursor is not None:
+        # Only return items completed since the client's last poll.
+        # Task state is read first so a finished task never hides trailing items.
+        items = spotify.read_transfer_items(
+            redis_client, progress_key, max(cursor, 0))
+        current_app.logger.debug(
+            "Returning %d items for task %s from cursor %d", len(items), task_id, cursor)
+        return jsonify({
+            "state": state,
+            "progress": progress,
+            "items": items,
+            "cursor": max(cursor, 0) + len(items),
+            "result": None
+        })
+
+    if state != 'SUCCESS':
+        return jsonify({
+            "state": state,
+            "progress": progress,
+            "result": None
+        })
+
+    summary = task.result
+    result = spotify.read_transfer_result(
+        redis_client, summary, offset, None if limit is None else max(limit, 0))
+    if result is None:
+        current_app.logger.error(
+            "Result of task %s has expired", task_id)
+        return jsonify({"error": "Transfer result has expired"}), 410
 
     return jsonify({
         "state": state,
         "progress": progress,
-        "result": result
+        "result": result,
+        "result_total": len(summary) if isinstance(summary, list) else summary['count'],
+        "offset": offset
     })
 
 
+def wait_for_final_state(task_id, timeout=EVENTS_FINAL_STATE_WAIT, interval=0.1):
+    """
+    Wait until a task has finished, for at most timeout seconds.
+
+    Returns:
+        str: The task's final state, or its current state once the timeout has passed.
+    """
+    deadline = time.monotonic() + timeout
+    state = AsyncResult(task_id, app=celery).state
+    while state not in states.READY_STATES and time.monotonic() < deadline:
+        time.sleep(interval)
+        state = AsyncResult(task_id, app=celery).state
+    return state
+
+
+@spotify_bp.route('/transfer_collection_events', methods=['GET'])
+def transfer_collection_events():
+    """ Stream transfer progress and completed items as Server-Sent Events """
+    progress_key = request.args.get('progress_key')
+    task_id = request.args.get('task_id')
+    # EventSource sends the id of the last event it received when it reconnects
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+        cursor = request.args.get('cursor', 0, type=int)
+    cursor = max(cursor, 0)
+    if not progress_key or not task_id:
+        current_app.logger.error("Missing progress key or task id")
+        return jsonify({"error": "Missing progress_key or task_id"}), 400
+
+    if not event_stream_slots.acquire(blocking=False):
+        current_app.logger.warning(
+            "Too many open event streams, refused stream for task %s", task_id)
+        response = jsonify(
+            {"error": "Too many open event streams, poll the status endpoint instead."})
+        response.headers['Retry-After'] = str(EVENTS_MAX_DURATION)
+        return response, 503
+
+    # Subscribe before the first read so that no update is missed in between
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(spotify.transfer_events_channel(progress_key))
+    except Exception:
+        event_stream_slots.release()
+        raise
+    current_app.logger.debug(
+        "Opened event stream for task %s from cursor %d", task_id, cursor)
+
+    def format_event(event, data, event_id=None):
+        event_id = '' if event_id is None else f"id: {event_id}\n"
+        return f"{event_id}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        nonlocal cursor
+        started_at = time.monotonic()
+        update = True
+        try:
+            while time.monotonic() - started_at < EVENTS_MAX_DURATION:
+                if update:
+                    progress = spotify.read_transfer_progress(
+                        redis_client, progress_key) or {"current": 0, "total": 0}
+                    items = spotify.read_transfer_items(
+                        redis_client, progress_key, cursor)
+                    cursor += len(items)
+                    yield format_event('progress', {
+                        "progress": progress,
+                        "items": items,
+                        "cursor": cursor
+                    }, cursor)
+
+                    if progress.get('finished'):
+                        yield format_event('finished', {"state": wait_for_final_state(task_id)})
+                        return
+
+                message = pubsub.get_message(
+                    timeout=EVENTS_HEARTBEAT_INTERVAL)
+                update = message is not None
+                if not update:
+                    # Nothing published for a while, make sure the task is still alive
+                    state = AsyncResult(task_id, app=celery).state
+                    if state in ('FAILURE', 'REVOKED'):
+                        yield format_event('finished', {"state": state})
+                        return
+                    yield ": keep-alive\n\n"
+        finally:
+            pubsub.close()
+
+    response = Response(stream_with_context(generate()),
+                        mimetype='text/event-stream')
+    # Released when the server closes the response, even if the stream never started
+    response.call_on_close(event_stream_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @spotify_bp.route('/create_playlist', methods=['POST'])
 def handle_create_playlist():
     data = request.get_json()
@@ -108,42 +312,94 @@ def handle_create_playlist():
         return jsonify({"error": "Missing state or playlist items."}), 400
 
     # Get the redis session with the state key
-    session_key = f"discofy:state:{spotify_state}"
-    session_data = redis_client.get(session_key)
+    session_key = session_store.key(spotify_state)
+    session_data = session_store.get(spotify_state, 'spotify_tokens')
 
-    if not session_data:
+    if session_data is None:
         current_app.logger.error(
             "Requested session key: %s not found in Redis. Session not authorized.", session_key)
         return jsonify({"error": "Unauthorized or expired session"}), 401
 
-    session_data = json.loads(session_data)
-
     if 'spotify_tokens' not in session_data or 'access_token' not in session_data.get('spotify_tokens', {}):
         current_app.logger.error(
             "Session tokens not found in session data for session key: %s", session_key)
         return jsonify({"error": "Unauthorized or incomplete Spotify session"}), 401
 
-    access_token = session_data['spotify_tokens']['access_token']
-
     sanitized_name = clean(playlist_name, tags=[], attributes={}, strip=True)
-    # create a playlist and get url returned
-    playlist_url = spotify.create_playlist(
-        playlist_items, sanitized_name, access_token)
 
-    if playlist_url:
-        return jsonify({
-            "status": "success",
-            "message": "Playlist created successfully.",
-            "url": playlist_url
-        })
+    # Generate a unique progress key for this task
+    progress_key = f"{spotify.PLAYLIST_PROGRESS_PREFIX}{uuid.uuid4()}"
+
+    # Create the playlist in the background, the url is the task result
+    task = create_playlist_task.apply_async(
+        args=[playlist_items, sanitized_name, spotify_state, progress_key])
+    current_app.logger.debug(
+        "Delegated playlist creation to Celery with task id: %s and progress key: %s", task.id, progress_key)
+
+    return jsonify({
+        "task_id": task.id,
+        "progress_key": progress_key
+    })
+
+
+@spotify_bp.route('/create_playlist_status', methods=['GET'])
+def create_playlist_status():
+    progress_key = request.args.get('progress_key')
+    task_id = request.args.get('task_id')
+    if not progress_key or not task_id:
+        current_app.logger.error("Missing progress key or task id")
+        return jsonify({"error": "Missing progress_key or task_id"}), 400
+
+    # Get progress from Redis
+    progress = spotify.read_playlist_progress(redis_client, progress_key)
+    if progress:
+        current_app.logger.debug(
+            "Playlist task %s progress: %s", task_id, progress)
     else:
+        current_app.logger.error(
+            "Progress object not found - returning default values")
+        progress = {"albums_resolved": 0, "albums_total": 0,
+                    "tracks_added": 0, "tracks_total": 0}
+
+    # Get task state
+    task = AsyncResult(task_id, app=celery)
+    state = task.state
+    current_app.logger.debug("Playlist task %s state: %s", task_id, state)
+
+    if state == 'SUCCESS' and not task.result:
         current_app.logger.error(
             "Playlist URL not available. Failed to create playlist.")
         return jsonify({
+            "state": state,
+            "progress": progress,
             "status": "error",
             "message": "Failed to create playlist.",
             "url": None
-        }), 500
+        })
+
+    return jsonify({
+        "state": state,
+        "progress": progress,
+        "status": "success" if state == 'SUCCESS' else None,
+        "url": task.result if state == 'SUCCESS' else None
+    })
+
+
+@spotify_bp.route('/request_budget', methods=['GET'])
+def request_budget():
+    """ Report usage of the Spotify request budget shared by all processes """
+    spotify_state = request.cookies.get('spotify_state')
+    if not spotify_state:
+        current_app.logger.error("Missing state")
+        return jsonify({"error": "Missing state"}), 400
+
+    session_data = session_store.get(spotify_state, 'spotify_tokens')
+    if not session_data or 'spotify_tokens' not in session_data:
+        current_app.logger.error(
+            "Requested session key: %s not found in Redis. Session not authorized.", session_store.key(spotify_state))
+        return jsonify({"error": "Unauthorized or expired session"}), 401
+
+    return jsonify(spotify.spotify_rate_limiter.usage())
 
 
 @spotify_bp.route('/get_auth_url')
@@ -158,14 +414,9 @@ def get_auth_url():
     }
 
     # Store in Redis with the state as part of the key
-    session_key = f"discofy:state:{spotify_state}"
     current_app.logger.debug(
-        "Creating session entry in Redis: %s", session_key)
-    redis_client.setex(
-        session_key,
-        timedelta(days=3),
-        json.dumps(session_data)
-    )
+        "Creating session entry in Redis: %s", session_store.key(spotify_state))
+    session_store.create(spotify_state, session_data)
 
     # TODO: check token caching
     oauth_object = SpotifyOAuth(
@@ -176,6 +427,7 @@ def get_auth_url():
         state=spotify_state,
         cache_path=".token_cache"
     )
+    oauth_object.OAUTH_AUTHORIZE_URL = SPOTIFY_AUTH_URL
 
     # Get auth url
     current_app.logger.debug("Requesting authorisation url")
@@ -207,16 +459,13 @@ def callback():
         return "Error: authorization code or state.", 400
 
     # Get the redis session with the state key
-    session_key = f"discofy:state:{spotify_state}"
-    session_data_str = redis_client.get(session_key)
+    session_data = session_store.get(spotify_state, 'created_at')
 
-    if not session_data_str:
+    if session_data is None:
         current_app.logger.error(
             'No session data found for Spotify callback.')
         return jsonify({"error": "Invalid or expired session state."}), 400
 
-    session_data = json.loads(session_data_str)
-
     try:
         # Exchange the auth code for an access token
         token_data = {
@@ -227,8 +476,8 @@ def callback():
             'client_secret': current_app.config.get('SPOTIFY_CLIENT_SECRET'),
         }
 
-        response = requests.post(SPOTIFY_TOKEN_URL, data=token_data)
-        token_info = response.json()
+        token_info = spotify.request_spotify_token(
+            SPOTIFY_TOKEN_URL, token_data)
 
         if 'error' in token_info:
             current_app.logger.error(
@@ -242,14 +491,8 @@ def callback():
         current_app.logger.info(
             "Spotify token successfully obtained. Saving in session. Expires at: %s", token_info['expires_at'])
         # Update session data with Spotify tokens
-        session_data['spotify_tokens'] = token_info
-
-        # Update in Redis
-        redis_client.setex(
-            session_key,
-            timedelta(days=3),
-            json.dumps(session_data)
-        )
+        session_store.set(spotify_state, {'spotify_tokens': token_info},
+                          remove=['spotify_profile'])
 
         return redirect(url_for('auth.success'))
 
@@ -272,64 +515,72 @@ def check_authorization():
             'message': 'cookie not found'
         }), 200
 
-    # Get the redis session with the state key
-    session_key = f"discofy:state:{spotify_state}"
-    session_data_str = redis_client.get(session_key)
+    # Get the redis session with the state key and keep it alive in the same round trip
+    session_data = session_store.get(
+        spotify_state, 'spotify_tokens', 'spotify_profile', touch=True)
 
-    if not session_data_str:
+    if session_data is None:
         current_app.logger.warning(
-            "User not authorized. Session data could not be found for session key: %s", session_key)
+            "User not authorized. Session data could not be found for session key: %s", session_store.key(spotify_state))
         return jsonify({
             'authorized': False,
             'message': 'session data not found'
         }), 200
 
-    session_data = json.loads(session_data_str)
-
-    # Check if token needs refresh and refresh if needed
-    session_data = spotify.check_token_expiry(session_data, SPOTIFY_TOKEN_URL)
-
-    # Update session in Redis with possibly refreshed token
-    redis_client.setex(
-        session_key,
-        timedelta(days=3),
-        json.dumps(session_data)
-    )
+    # Check if token needs refresh and refresh if needed, a refreshed token is stored right away
+    session_data = spotify.refresh_session_token(
+        session_store, spotify_state, session_data) or session_data
+    profile_fetched = False
 
     if session_data and 'spotify_tokens' in session_data and session_data['spotify_tokens'].get('expires_at', 0) > time.time():
         spotify_access_token = session_data['spotify_tokens'].get(
             'access_token')
 
-        # Extract the username (Spotify user ID) from the user profile
-        try:
-            spotify_client = spotipy.Spotify(auth=spotify_access_token)
-            user_profile = spotify_client.current_user()
-            username = user_profile['id']
-            user_url = user_profile['external_urls']['spotify']
-
+        # Extract the username (Spotify user ID) from the user profile, cached in the session for a few minutes
+        profile = session_data.get('spotify_profile')
+        if not profile or profile.get('fetched_at', 0) + PROFILE_CACHE_TTL < time.time():
+            try:
+                spotify_client = spotify.get_spotify_client(
+                    spotify_access_token)
+                user_profile = spotify_client.current_user()
+                profile = {
+                    'id': user_profile['id'],
+                    'url': user_profile['external_urls']['spotify'],
+                    'fetched_at': int(time.time())
+                }
+                profile_fetched = True
+
+            except Exception as e:
+                current_app.logger.error(
+                    "Error getting Spotify user profile: %s", e, exc_info=True)
+                profile = None
+                response = jsonify({
+                    'authorized': False,
+                    'error': str(e)
+                }), 400
+
+        if profile:
             current_app.logger.info(
-                "User %s connected to Spotify successfully", username)
+                "User %s connected to Spotify successfully", profile['id'])
 
-            return jsonify({
+            response = jsonify({
                 'authorized': True,
-                'username': username,
-                'url': user_url
+                'username': profile['id'],
+                'url': profile['url']
             })
-
-        except Exception as e:
-            current_app.logger.error(
-                "Error getting Spotify user profile: %s", e, exc_info=True)
-            return jsonify({
-                'authorized': False,
-                'error': str(e)
-            }), 400
     else:
         # If the token is expired or not present, consider the user not authorized
-        return jsonify({
+        response = jsonify({
             'authorized': False,
             'message': 'spotify token expired or not present'
         }), 200
 
+    # Only write the session back if the profile was fetched
+    if profile_fetched:
+        session_store.set(spotify_state, {'spotify_profile': profile})
+
+    return response
+
 
 @spotify_bp.route('/logout', methods=['POST'])
 def logout():
@@ -343,10 +594,9 @@ def logout():
             "message": "No session found."
         }), 400
 
-    session_key = f"discofy:state:{spotify_state}"
-
-    current_app.logger.info("Removing session: %s from Redis", session_key)
-    redis_client.delete(session_key)
+    current_app.logger.info(
+        "Removing session: %s from Redis", session_store.key(spotify_state))
+    session_store.delete(spotify_state)
 
     response = jsonify({
         "status": "success",
@@ -0,0 +1,187 @@
+"""
+Micro-benchmarks for the Discogs/Spotify matching functions.
+
+Runs sanitize, is_match and match_pairs from app.services.spotify and sanitise_string from
+app.services.discogs over the frozen corpus in benchmarks/fixtures/matching_corpus.json.
+Reports throughput and memory allocations, and checks every decision against
+benchmarks/fixtures/matching_golden.json. Exits with status 1 if any result differs,
+so it can be used to gate changes to the matching code. No network access is needed.
+
+Usage:
+    python -m benchmarks.matching [--repeat N] [--rounds N] [--update-golden]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+from app.services.discogs import sanitise_string
+from app.services.spotify import sanitize, is_match, match_pairs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+CORPUS_PATH = os.path.join(FIXTURES_DIR, 'matching_corpus.json')
+GOLDEN_PATH = os.path.join(FIXTURES_DIR, 'matching_golden.json')
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compute_results(corpus):
+    """
+    Compute the outputs of every matching function for each corpus entry, in the golden file format.
+    """
+    decisions = match_pairs(
+        [(p['discogs_artist'], p['discogs_album']) for p in corpus],
+        [(p['spotify_artist'], p['spotify_album']) for p in corpus])
+
+    results = []
+    for pair, batch_decision in zip(corpus, decisions):
+        match, score = is_match(pair['discogs_artist'], pair['discogs_album'],
+                                pair['spotify_artist'], pair['spotify_album'])
+        results.append({
+            'match': match,
+            'score': score,
+            'batch_match': batch_decision[0],
+            'batch_score': batch_decision[1],
+            'sanitised_artist': sanitise_string(pair['discogs_artist']),
+            'sanitized': [sanitize(pair[key]) for key in (
+                'discogs_artist', 'discogs_album', 'spotify_artist', 'spotify_album')],
+        })
+    return results
+
+
+def check_parity(corpus, results, golden):
+    """
+    Compare computed results with the golden file and with each other.
+
+    Returns:
+        list: Human readable descriptions of every difference found.
+    """
+    errors = []
+    if len(golden) != len(corpus):
+        errors.append(
+            f"Golden file has {len(golden)} entries, corpus has {len(corpus)}")
+
+    for idx, (pair, result, expected) in enumerate(zip(corpus, results, golden)):
+        label = f"#{idx} '{pair['discogs_artist']} - {pair['discogs_album']}'"
+        for key, value in expected.items():
+            if result.get(key) != value:
+                errors.append(
+                    f"{label}: {key} is {result.get(key)!r}, expected {value!r}")
+        if (result['batch_match'], result['batch_score']) != (result['match'], result['score']):
+            errors.append(f"{label}: match_pairs disagrees with is_match")
+    return errors
+
+
+def benchmark(name, func, workload, rounds, items=None):
+    """
+    Time func over the workload and measure its allocations.
+    items is the number of inputs in the workload, defaults to len(workload).
+
+    The sanitize memo is cleared before each round, so timings include normalising every string at least once.
+
+    Returns:
+        dict: Benchmark name, throughput and allocation figures.
+    """
+    best = None
+    for _ in range(rounds):
+        sanitize.cache_clear()
+        start = time.perf_counter()
+        func(workload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    sanitize.cache_clear()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func(workload)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    allocated_blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+
+    items = len(workload) if items is None else items
+    return {
+        'name': name,
+        'items': items,
+        'seconds': best,
+        'per_second': items / best if best else float('inf'),
+        'peak_kib': peak / 1024,
+        'retained_blocks': allocated_blocks,
+    }
+
+
+def run_benchmarks(corpus, repeat, rounds):
+    pairs = corpus * repeat
+    strings = [pair[key] for pair in pairs for key in (
+        'discogs_artist', 'discogs_album', 'spotify_artist', 'spotify_album')]
+    artists = [pair['discogs_artist'] for pair in pairs]
+    discogs_pairs = [(p['discogs_artist'], p['discogs_album']) for p in pairs]
+    spotify_pairs = [(p['spotify_artist'], p['spotify_album']) for p in pairs]
+
+    return [
+        benchmark('sanitize', lambda work: [sanitize(s) for s in work], strings, rounds),
+        benchmark('sanitise_string', lambda work: [
+                  sanitise_string(s) for s in work], artists, rounds),
+        benchmark('is_match', lambda work: [is_match(*pair) for pair in work],
+                  [(p['discogs_artist'], p['discogs_album'], p['spotify_artist'], p['spotify_album'])
+                   for p in pairs], rounds),
+        benchmark('match_pairs', lambda work: match_pairs(*work),
+                  (discogs_pairs, spotify_pairs), rounds, items=len(pairs)),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='Number of times the corpus is repeated per round (default: 50)')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Number of timed rounds, the fastest is reported (default: 5)')
+    parser.add_argument('--update-golden', action='store_true',
+                        help='Rewrite the golden file from the current implementation')
+    args = parser.parse_args(argv)
+
+    # The matching functions log every comparison at debug level
+    logging.disable(logging.CRITICAL)
+
+    corpus = load_corpus()
+    results = compute_results(corpus)
+
+    if args.update_golden:
+        golden = [{key: value for key, value in result.items() if not key.startswith('batch_')}
+                  for result in results]
+        with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+            json.dump(golden, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"Wrote {len(golden)} golden results to {GOLDEN_PATH}")
+        return 0
+
+    with open(GOLDEN_PATH, encoding='utf-8') as f:
+        golden = json.load(f)
+    errors = check_parity(corpus, results, golden)
+
+    rows = run_benchmarks(corpus, args.repeat, args.rounds)
+
+    print(f"{'benchmark':<16}{'items':>10}{'best (s)':>12}{'items/s':>14}{'peak KiB':>12}{'retained':>10}")
+    for row in rows:
+        print(f"{row['name']:<16}{row['items']:>10}{row['seconds']:>12.4f}"
+              f"{row['per_second']:>14,.0f}{row['peak_kib']:>12.1f}{row['retained_blocks']:>10}")
+
+    if errors:
+        print(f"\nParity check FAILED with {len(errors)} differences:")
+        for error in errors:
+            print(f"  {error}")
+        return 1
+
+    print(f"\nParity check passed for {len(corpus)} corpus entries")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
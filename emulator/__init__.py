@@ -0,0 +1,531 @@
+"""
+Local stand-in for the Spotify and Discogs APIs used by Discofy.
+
+Serves a deterministic synthetic catalogue so that transfers, playlist creation and collection
+imports can be load tested without using real API quota. Latency, rate limiting (429 with
+Retry-After) and error injection are configurable through EMULATOR_* environment variables
+or at runtime through the /_emulator/config endpoint.
+
+Point the app and the Celery worker at it with:
+    SPOTIFY_API_URL=http://<host>:5050/v1/
+    SPOTIFY_ACCOUNTS_URL=http://<host>:5050
+    SPOTIFY_AUTH_URL=http://<host>:5050/authorize
+    DISCOGS_API_URL=http://<host>:5050/discogs
+    DISCOGS_AUTHORIZE_URL=http://<host>:5050/discogs/oauth/authorize
+"""
+import os
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from urllib.parse import urlencode
+
+from flask import Flask, jsonify, request, redirect, abort
+
+# Words used to build synthetic artist names and album titles
+ARTIST_WORDS = ['Velvet', 'Static', 'Northern', 'Lunar', 'Echo', 'Glass', 'Copper', 'Silent', 'Paper',
+                'Electric', 'Hollow', 'Golden', 'Crystal', 'Midnight', 'Wild', 'Neon', 'Iron', 'Blue']
+ARTIST_NOUNS = ['Harbour', 'Engines', 'Orchestra', 'Collective', 'Sisters', 'Machines', 'Garden',
+                'Ghosts', 'Tides', 'Saints', 'Parade', 'Foxes', 'Lanterns', 'Rivers', 'Quartet']
+TITLE_WORDS = ['Songs', 'Of', 'The', 'Night', 'Distant', 'Shores', 'Fading', 'Light', 'Afterglow',
+               'Signals', 'Weather', 'Systems', 'Under', 'Open', 'Skies', 'Second', 'Nature', 'Letters',
+               'From', 'Home', 'Slow', 'Motion', 'Heavy', 'Water', 'Bright', 'Future', 'Lost', 'Tapes']
+FORMATS = [('Vinyl', ['LP', 'Album']), ('Vinyl', ['LP', 'Album', 'Reissue']), ('CD', ['Album']),
+           ('Vinyl', ['7"', 'Single']), ('Cassette', ['Album'])]
+
+DEFAULT_CONFIG = {
+    # Mean added latency and uniform jitter per request, in milliseconds
+    'latency_ms': float(os.environ.get('EMULATOR_LATENCY_MS', 0)),
+    'jitter_ms': float(os.environ.get('EMULATOR_JITTER_MS', 0)),
+    # Requests per second accepted across all clients, 0 disables rate limiting
+    'rate_limit': float(os.environ.get('EMULATOR_RATE_LIMIT', 0)),
+    # Retry-After value sent with 429 responses, in seconds
+    'retry_after': int(os.environ.get('EMULATOR_RETRY_AFTER', 1)),
+    # Fraction of requests answered with a random error_statuses response
+    'error_rate': float(os.environ.get('EMULATOR_ERROR_RATE', 0)),
+    'error_statuses': [500, 502, 503],
+    # Number of releases in the emulated Discogs collection
+    'collection_size': int(os.environ.get('EMULATOR_COLLECTION_SIZE', 1000)),
+    'seed': int(os.environ.get('EMULATOR_SEED', 0)),
+}
+
+SPOTIFY_USER_ID = 'emulator-user'
+DISCOGS_USERNAME = 'emulator'
+DISCOGS_PER_PAGE_MAX = 100
+SEARCH_LIMIT_MAX = 50
+ALBUMS_IDS_MAX = 20
+TRACKS_LIMIT_MAX = 50
+PLAYLIST_ITEMS_MAX = 100
+
+
+class Catalogue:
+    """
+    Deterministic synthetic catalogue shared by the emulated Discogs collection and Spotify search.
+
+    Release i is described by _release(i). Its Spotify counterpart depends on i % 10:
+    0-6 are found by the first search pass, 7 is found with a '(Remastered)' suffix,
+    8 is only found by title-only passes and 9 is not on Spotify at all.
+    """
+
+    def __init__(self, size, seed):
+        self.size = size
+        self.seed = seed
+        self._releases = [self._release(i) for i in range(size)]
+        self._by_title = {}
+        for release in self._releases:
+            self._by_title.setdefault(release['title'].lower(), []).append(release)
+
+    def _release(self, i):
+        rng = random.Random(self.seed * 1_000_003 + i)
+        artist = f"{rng.choice(ARTIST_WORDS)} {rng.choice(ARTIST_NOUNS)}"
+        if rng.random() < 0.1:
+            # Discogs disambiguation suffix
+            artist = f"{artist} ({rng.randint(2, 9)})"
+        title = ' '.join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(1, 4)))
+        format_name, descriptions = rng.choice(FORMATS)
+        return {
+            'index': i,
+            'discogs_id': 100_000 + i,
+            'instance_id': 9_000_000 + i,
+            'artist': artist,
+            'title': f"{title} {i}",
+            'year': 1960 + i % 64,
+            'format': format_name,
+            'descriptions': descriptions,
+            # Albums longer than one page of tracks exercise pagination
+            'track_count': 4 + (i * 7) % 60,
+            'added': 1_500_000_000 + i * 3600,
+        }
+
+    def release(self, i):
+        return self._releases[i]
+
+    def releases(self):
+        return self._releases
+
+    def album_id(self, release):
+        return f"emu{release['index']:019d}"
+
+    def release_for_album(self, album_id):
+        try:
+            index = int(album_id[3:])
+        except ValueError:
+            return None
+        if not album_id.startswith('emu') or not 0 <= index < self.size:
+            return None
+        release = self._releases[index]
+        return release if self.on_spotify(release) else None
+
+    def on_spotify(self, release):
+        return release['index'] % 10 != 9
+
+    def spotify_album(self, release, base_url, tracks=False):
+        album_id = self.album_id(release)
+        title = release['title']
+        if release['index'] % 10 == 7:
+            title = f"{title} (Remastered)"
+        artist = release['artist'].rsplit(' (', 1)[0]
+        album = {
+            'album_type': 'album',
+            'id': album_id,
+            'name': title,
+            'artists': [{'id': f"artist{zlib.crc32(artist.encode())}", 'name': artist, 'type': 'artist'}],
+            'images': [{'url': f"{base_url}images/{album_id}.jpg", 'height': 640, 'width': 640}],
+            'external_urls': {'spotify': f"{base_url}album/{album_id}"},
+            'href': f"{base_url}v1/albums/{album_id}",
+            'uri': f"spotify:album:{album_id}",
+            'total_tracks': release['track_count'],
+            'release_date': str(release['year']),
+            'type': 'album',
+        }
+        if tracks:
+            album['tracks'] = self.track_page(release, base_url, 0, TRACKS_LIMIT_MAX)
+        return album
+
+    def track_page(self, release, base_url, offset, limit):
+        album_id = self.album_id(release)
+        total = release['track_count']
+        items = [{
+            'id': f"{album_id}t{number:03d}",
+            'name': f"Track {number}",
+            'track_number': number,
+            'uri': f"spotify:track:{album_id}t{number:03d}",
+            'type': 'track',
+        } for number in range(offset + 1, min(offset + limit, total) + 1)]
+        href = f"{base_url}v1/albums/{album_id}/tracks"
+        return {
+            'href': f"{href}?{urlencode({'offset': offset, 'limit': limit})}",
+            'items': items,
+            'limit': limit,
+            'offset': offset,
+            'total': total,
+            'next': f"{href}?{urlencode({'offset': offset + limit, 'limit': limit})}" if offset + limit < total else None,
+            'previous': f"{href}?{urlencode({'offset': max(offset - limit, 0), 'limit': limit})}" if offset else None,
+        }
+
+    def search(self, query):
+        """
+        Return the releases matching a Spotify search query built by match_collection_item.
+        """
+        artist = None
+        title_only = False
+        if ' artist:' in query:
+            title, artist = query.split(' artist:', 1)
+        elif query.startswith('album:'):
+            title, title_only = query[len('album:'):], True
+        else:
+            title, title_only = query, True
+
+        results = []
+        for release in self._by_title.get(title.strip().lower(), []):
+            if not self.on_spotify(release):
+                continue
+            if release['index'] % 10 == 8 and not title_only:
+                continue
+            if artist and artist.strip().lower() not in release['artist'].lower():
+                continue
+            results.append(release)
+        return results
+
+    def decoys(self, query, count):
+        # Unrelated albums returned after (or instead of) real hits, as Spotify does
+        rng = random.Random(f"{self.seed}:{query}")
+        candidates = [release for release in rng.sample(self._releases, min(len(self._releases), count * 2))
+                      if self.on_spotify(release)]
+        return candidates[:count]
+
+
+class FaultInjector:
+    """
+    Applies latency, a global token bucket rate limit and random errors to incoming requests.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._tokens = config['rate_limit']
+        self._updated = time.monotonic()
+
+    def check(self):
+        """
+        Returns:
+            tuple or None: (status, headers) of the injected failure, or None if the request should be served.
+        """
+        latency = self.config['latency_ms'] + random.uniform(0, self.config['jitter_ms'])
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+        rate_limit = self.config['rate_limit']
+        if rate_limit > 0:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(rate_limit, self._tokens + (now - self._updated) * rate_limit)
+                self._updated = now
+                if self._tokens < 1:
+                    return 429, {'Retry-After': str(self.config['retry_after'])}
+                self._tokens -= 1
+
+        if self.config['error_rate'] > 0 and random.random() < self.config['error_rate']:
+            return random.choice(self.config['error_statuses']), {}
+
+        return None
+
+
+def create_emulator_app(config=None):
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+
+    state = {
+        'config': dict(DEFAULT_CONFIG, **(config or {})),
+        'stats': Counter(),
+        'playlists': {},
+        'request_tokens': {},
+    }
+    state['catalogue'] = Catalogue(state['config']['collection_size'], state['config']['seed'])
+    state['faults'] = FaultInjector(state['config'])
+    stats_lock = threading.Lock()
+
+    def base_url():
+        return request.host_url
+
+    def discogs_url():
+        return f"{request.host_url}discogs"
+
+    def spotify_error(status, message):
+        return jsonify({'error': {'status': status, 'message': message}}), status
+
+    @app.before_request
+    def inject_faults():
+        if request.path.startswith('/_emulator'):
+            return None
+
+        endpoint = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+        with stats_lock:
+            state['stats'][endpoint] += 1
+
+        failure = state['faults'].check()
+        if failure:
+            status, headers = failure
+            with stats_lock:
+                state['stats'][f"{status} {endpoint}"] += 1
+            response = jsonify({'error': {'status': status, 'message': 'Injected by emulator'},
+                                'message': 'Injected by emulator'})
+            response.status_code = status
+            response.headers.update(headers)
+            return response
+        return None
+
+    @app.after_request
+    def discogs_rate_limit_headers(response):
+        if request.path.startswith('/discogs'):
+            response.headers['X-Discogs-Ratelimit'] = '60'
+            response.headers['X-Discogs-Ratelimit-Used'] = '0'
+            response.headers['X-Discogs-Ratelimit-Remaining'] = '60'
+        return response
+
+    # Emulator control
+
+    @app.route('/_emulator/config', methods=['GET', 'POST'])
+    def emulator_config():
+        if request.method == 'POST':
+            updates = request.get_json() or {}
+            unknown = set(updates) - set(DEFAULT_CONFIG)
+            if unknown:
+                return jsonify({'error': f"Unknown settings: {sorted(unknown)}"}), 400
+            state['config'].update(updates)
+            if {'collection_size', 'seed'} & set(updates):
+                state['catalogue'] = Catalogue(state['config']['collection_size'], state['config']['seed'])
+        return jsonify(state['config'])
+
+    @app.route('/_emulator/stats', methods=['GET'])
+    def emulator_stats():
+        return jsonify(dict(state['stats']))
+
+    @app.route('/_emulator/reset', methods=['POST'])
+    def emulator_reset():
+        with stats_lock:
+            state['stats'].clear()
+        state['playlists'].clear()
+        return jsonify({'status': 'reset'})
+
+    # Spotify accounts
+
+    @app.route('/authorize', methods=['GET'])
+    def spotify_authorize():
+        redirect_uri = request.args.get('redirect_uri')
+        if not redirect_uri:
+            abort(400)
+        params = {'code': f"code-{uuid.uuid4().hex}", 'state': request.args.get('state', '')}
+        return redirect(f"{redirect_uri}?{urlencode(params)}")
+
+    @app.route('/api/token', methods=['POST'])
+    def spotify_token():
+        grant_type = request.form.get('grant_type')
+        if grant_type not in ('authorization_code', 'refresh_token'):
+            return jsonify({'error': 'unsupported_grant_type',
+                            'error_description': 'grant_type must be authorization_code or refresh_token'}), 400
+        token = {
+            'access_token': f"access-{uuid.uuid4().hex}",
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'scope': 'playlist-modify-public',
+        }
+        if grant_type == 'authorization_code':
+            token['refresh_token'] = f"refresh-{uuid.uuid4().hex}"
+        return jsonify(token)
+
+    # Spotify Web API
+
+    @app.route('/v1/me', methods=['GET'])
+    def spotify_me():
+        return jsonify({
+            'id': SPOTIFY_USER_ID,
+            'display_name': 'Emulator User',
+            'external_urls': {'spotify': f"{base_url()}user/{SPOTIFY_USER_ID}"},
+            'type': 'user',
+        })
+
+    @app.route('/v1/search', methods=['GET'])
+    def spotify_search():
+        query = request.args.get('q', '')
+        limit = request.args.get('limit', 20, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if request.args.get('type') != 'album':
+            return spotify_error(400, 'Only album search is emulated')
+        if not 1 <= limit <= SEARCH_LIMIT_MAX:
+            return spotify_error(400, 'Invalid limit')
+
+        catalogue = state['catalogue']
+        hits = catalogue.search(query)
+        releases = hits + [release for release in catalogue.decoys(query, limit) if release not in hits]
+        page = releases[offset:offset + limit]
+        return jsonify({'albums': {
+            'href': request.url,
+            'items': [catalogue.spotify_album(release, base_url()) for release in page],
+            'limit': limit,
+            'offset': offset,
+            'total': len(releases),
+            'next': None,
+            'previous': None,
+        }})
+
+    @app.route('/v1/albums', methods=['GET'])
+    def spotify_albums():
+        ids = [album_id for album_id in request.args.get('ids', '').split(',') if album_id]
+        if not 0 < len(ids) <= ALBUMS_IDS_MAX:
+            return spotify_error(400, 'Invalid ids')
+        catalogue = state['catalogue']
+        return jsonify({'albums': [
+            catalogue.spotify_album(release, base_url(), tracks=True) if release else None
+            for release in (catalogue.release_for_album(album_id) for album_id in ids)
+        ]})
+
+    @app.route('/v1/albums/<album_id>/tracks', methods=['GET'])
+    def spotify_album_tracks(album_id):
+        release = state['catalogue'].release_for_album(album_id)
+        if release is None:
+            return spotify_error(404, 'Non existing id')
+        limit = request.args.get('limit', 20, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if not 1 <= limit <= TRACKS_LIMIT_MAX:
+            return spotify_error(400, 'Invalid limit')
+        return jsonify(state['catalogue'].track_page(release, base_url(), offset, limit))
+
+    @app.route('/v1/users/<user_id>/playlists', methods=['POST'])
+    def spotify_create_playlist(user_id):
+        if user_id != SPOTIFY_USER_ID:
+            return spotify_error(403, 'You cannot create a playlist for another user')
+        payload = request.get_json(force=True, silent=True) or {}
+        playlist_id = uuid.uuid4().hex[:22]
+        state['playlists'][playlist_id] = {'name': payload.get('name'), 'tracks': 0}
+        return jsonify({
+            'id': playlist_id,
+            'name': payload.get('name'),
+            'description': payload.get('description'),
+            'public': payload.get('public', True),
+            'external_urls': {'spotify': f"{base_url()}playlist/{playlist_id}"},
+            'uri': f"spotify:playlist:{playlist_id}",
+            'type': 'playlist',
+        }), 201
+
+    @app.route('/v1/playlists/<playlist_id>/tracks', methods=['POST'])
+    def spotify_add_playlist_items(playlist_id):
+        playlist = state['playlists'].get(playlist_id)
+        if playlist is None:
+            return spotify_error(404, 'Not found')
+        # Spotipy sends the URIs as a bare JSON array, the API also accepts {"uris": [...]}
+        payload = request.get_json(force=True, silent=True) or []
+        uris = payload.get('uris') or [] if isinstance(payload, dict) else payload
+        if not 0 < len(uris) <= PLAYLIST_ITEMS_MAX:
+            return spotify_error(400, f"You can add a maximum of {PLAYLIST_ITEMS_MAX} tracks per request")
+        playlist['tracks'] += len(uris)
+        return jsonify({'snapshot_id': uuid.uuid4().hex}), 201
+
+    # Discogs OAuth
+
+    @app.route('/discogs/oauth/request_token', methods=['POST'])
+    def discogs_request_token():
+        token = f"request-{uuid.uuid4().hex}"
+        state['request_tokens'][token] = request.form.get('oauth_callback')
+        return f"oauth_token={token}&oauth_token_secret={uuid.uuid4().hex}&oauth_callback_confirmed=true", 200, {
+            'Content-Type': 'application/x-www-form-urlencoded'}
+
+    @app.route('/discogs/oauth/authorize', methods=['GET'])
+    def discogs_authorize():
+        token = request.args.get('oauth_token')
+        callback = state['request_tokens'].pop(token, None)
+        if not callback:
+            abort(400)
+        separator = '&' if '?' in callback else '?'
+        params = {'oauth_token': token, 'oauth_verifier': uuid.uuid4().hex[:10]}
+        return redirect(f"{callback}{separator}{urlencode(params)}")
+
+    @app.route('/discogs/oauth/access_token', methods=['POST'])
+    def discogs_access_token():
+        return f"oauth_token=access-{uuid.uuid4().hex}&oauth_token_secret={uuid.uuid4().hex}", 200, {
+            'Content-Type': 'application/x-www-form-urlencoded'}
+
+    # Discogs API
+
+    def discogs_user():
+        return {
+            'id': 1,
+            'username': DISCOGS_USERNAME,
+            'resource_url': f"{discogs_url()}/users/{DISCOGS_USERNAME}",
+            'uri': f"{base_url()}user/{DISCOGS_USERNAME}",
+            'collection_folders_url': f"{discogs_url()}/users/{DISCOGS_USERNAME}/collection/folders",
+            'num_collection': state['catalogue'].size,
+        }
+
+    def discogs_folders():
+        size = state['catalogue'].size
+        folders_url = f"{discogs_url()}/users/{DISCOGS_USERNAME}/collection/folders"
+        return [
+            {'id': 0, 'name': 'All', 'count': size, 'resource_url': f"{folders_url}/0"},
+            {'id': 1, 'name': 'Uncategorized', 'count': size, 'resource_url': f"{folders_url}/1"},
+        ]
+
+    @app.route('/discogs/oauth/identity', methods=['GET'])
+    def discogs_identity():
+        user = discogs_user()
+        return jsonify({'id': user['id'], 'username': user['username'],
+                        'resource_url': user['resource_url'], 'consumer_name': 'Discofy'})
+
+    @app.route('/discogs/users/<username>', methods=['GET'])
+    def discogs_profile(username):
+        if username != DISCOGS_USERNAME:
+            return jsonify({'message': 'User does not exist or may have been deleted.'}), 404
+        return jsonify(discogs_user())
+
+    @app.route('/discogs/users/<username>/collection/folders', methods=['GET'])
+    def discogs_collection_folders(username):
+        if username != DISCOGS_USERNAME:
+            return jsonify({'message': 'User does not exist or may have been deleted.'}), 404
+        return jsonify({'folders': discogs_folders()})
+
+    @app.route('/discogs/users/<username>/collection/folders/<int:folder_id>/releases', methods=['GET'])
+    def discogs_folder_releases(username, folder_id):
+        if username != DISCOGS_USERNAME or folder_id not in (0, 1):
+            return jsonify({'message': 'Folder not found.'}), 404
+
+        page = request.args.get('page', 1, type=int)
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), DISCOGS_PER_PAGE_MAX)
+        releases = state['catalogue'].releases()
+        if request.args.get('sort') == 'added' and request.args.get('sort_order') == 'desc':
+            releases = releases[::-1]
+
+        total = len(releases)
+        pages = max((total + per_page - 1) // per_page, 1)
+        if page < 1 or page > pages:
+            return jsonify({'message': 'Page not found.'}), 404
+
+        url = f"{discogs_url()}/users/{username}/collection/folders/{folder_id}/releases"
+        page_releases = releases[(page - 1) * per_page:page * per_page]
+        return jsonify({
+            'pagination': {
+                'page': page,
+                'pages': pages,
+                'per_page': per_page,
+                'items': total,
+                'urls': {'next': f"{url}?{urlencode({'page': page + 1, 'per_page': per_page})}"} if page < pages else {},
+            },
+            'releases': [{
+                'id': release['discogs_id'],
+                'instance_id': release['instance_id'],
+                'folder_id': 1,
+                'rating': 0,
+                'date_added': time.strftime('%Y-%m-%dT%H:%M:%S-07:00', time.gmtime(release['added'])),
+                'basic_information': {
+                    'id': release['discogs_id'],
+                    'title': release['title'],
+                    'year': release['year'],
+                    'thumb': f"{base_url()}images/discogs/{release['discogs_id']}.jpg",
+                    'artists': [{'name': release['artist'], 'id': release['discogs_id'] % 5000}],
+                    'formats': [{'name': release['format'], 'qty': '1', 'descriptions': release['descriptions']}],
+                },
+            } for release in page_releases],
+        })
+
+    return app
@@ -0,0 +1,34 @@
+import argparse
+
+from . import DEFAULT_CONFIG, create_emulator_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the local Spotify/Discogs API emulator.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency-ms', type=float, default=DEFAULT_CONFIG['latency_ms'])
+    parser.add_argument('--jitter-ms', type=float, default=DEFAULT_CONFIG['jitter_ms'])
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_CONFIG['rate_limit'],
+                        help='Requests per second accepted before answering 429, 0 disables the limit')
+    parser.add_argument('--retry-after', type=int, default=DEFAULT_CONFIG['retry_after'])
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_CONFIG['error_rate'])
+    parser.add_argument('--collection-size', type=int, default=DEFAULT_CONFIG['collection_size'])
+    parser.add_argument('--seed', type=int, default=DEFAULT_CONFIG['seed'])
+    args = parser.parse_args()
+
+    app = create_emulator_app({
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'rate_limit': args.rate_limit,
+        'retry_after': args.retry_after,
+        'error_rate': args.error_rate,
+        'collection_size': args.collection_size,
+        'seed': args.seed,
+    })
+    # All state lives in this process, so serve with threads rather than several processes
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+
+import fakeredis
+
+from app.services.rate_limit import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+
+    def bucket(self, rate, burst=None, max_wait=5):
+        # Every bucket gets its own client on the same server, like separate processes sharing Redis
+        client = fakeredis.FakeRedis(server=self.server)
+        return TokenBucket(client, 'test:budget', rate, burst, max_wait, jitter=0)
+
+    def test_burst_then_refill(self):
+        bucket = self.bucket(rate=10, burst=2)
+
+        started = time.monotonic()
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(bucket.acquire())
+        self.assertLess(time.monotonic() - started, 0.05)
+
+        # The third token is only available after it has been refilled at 10 per second
+        self.assertTrue(bucket.acquire())
+        self.assertGreaterEqual(time.monotonic() - started, 0.08)
+
+        time.sleep(0.5)
+        usage = bucket.usage()
+        self.assertEqual(usage['granted'], 3)
+        self.assertAlmostEqual(usage['available'], 2)
+
+    def test_shared_rate_across_threads(self):
+        rate, burst, requests = 50, 5, 30
+        buckets = [self.bucket(rate, burst) for _ in range(6)]
+        granted = []
+
+        def worker(bucket):
+            for _ in range(requests // len(buckets)):
+                granted.append(bucket.acquire())
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker, args=(bucket,)) for bucket in buckets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(granted, [True] * requests)
+        # Apart from the burst, tokens are handed out at the shared rate however many clients ask
+        self.assertGreaterEqual(elapsed, (requests - burst) / rate * 0.9)
+        self.assertEqual(buckets[0].usage()['granted'], requests)
+
+    def test_pause_holds_back_every_client(self):
+        bucket = self.bucket(rate=100)
+        other = self.bucket(rate=100)
+
+        bucket.pause(0.3)
+        started = time.monotonic()
+        self.assertTrue(other.acquire())
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+        usage = other.usage()
+        self.assertEqual(usage['rate_limited'], 1)
+        self.assertEqual(usage['paused_for'], 0)
+
+    def test_pause_longer_than_max_wait(self):
+        bucket = self.bucket(rate=100, max_wait=0.1)
+
+        bucket.pause(1)
+        self.assertFalse(bucket.acquire())
+
+    def test_pause_keeps_longer_pause(self):
+        bucket = self.bucket(rate=100)
+
+        bucket.pause(2)
+        bucket.pause(0.1)
+        self.assertGreater(bucket.usage()['paused_for'], 1)
+
+    def test_disabled_bucket_skips_redis(self):
+        bucket = self.bucket(rate=0)
+
+        def unexpected(*args, **kwargs):
+            raise AssertionError("acquire called Redis with the budget disabled")
+        bucket._script = unexpected
+
+        self.assertTrue(bucket.acquire())
+
+        # A 429 still holds back the process that received it
+        bucket.pause(0.2)
+        started = time.monotonic()
+        self.assertTrue(bucket.acquire())
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import threading
+import unittest
+
+import fakeredis
+import redis
+
+from app.services.session_store import SessionStore, SESSION_UPDATE_RETRIES
+
+
+class SessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.client = fakeredis.FakeRedis(server=self.server)
+        self.store = SessionStore(self.client, prefix='test:state:')
+
+    def test_get_migrates_legacy_session(self):
+        legacy = {'spotify_tokens': {'access_token': 'a'}, 'discogs_identity': {'username': 'u'}}
+        self.client.set('test:state:s1', json.dumps(legacy), ex=600)
+
+        self.assertEqual(self.store.get('s1', 'spotify_tokens'), {'spotify_tokens': {'access_token': 'a'}})
+        self.assertEqual(self.client.type('test:state:s1'), b'hash')
+        self.assertEqual(self.store.get('s1'), legacy)
+        # The legacy session keeps its expiry
+        self.assertTrue(0 < self.client.ttl('test:state:s1') <= 600)
+
+    def test_set_migrates_legacy_session(self):
+        self.client.set('test:state:s1', json.dumps({'a': 1, 'b': 2}))
+
+        self.store.set('s1', {'c': 3}, remove=['b'])
+        self.assertEqual(self.store.get('s1'), {'a': 1, 'c': 3})
+
+    def test_update_migrates_legacy_session(self):
+        self.client.set('test:state:s1', json.dumps({'count': 1}))
+
+        result = self.store.update('s1', ['count'], lambda fields: {'count': fields['count'] + 1})
+        self.assertEqual(result, {'count': 2})
+        self.assertEqual(self.store.get('s1'), {'count': 2})
+
+    def test_update_missing_session(self):
+        self.assertIsNone(self.store.update('missing', ['count'], lambda fields: {'count': 1}))
+        self.assertFalse(self.client.exists('test:state:missing'))
+
+    def test_update_retries_after_concurrent_write(self):
+        self.store.create('s1', {'count': 0, 'other': 'x'})
+        other = SessionStore(fakeredis.FakeRedis(server=self.server), prefix='test:state:')
+        calls = []
+
+        def increment(fields):
+            calls.append(fields['count'])
+            if len(calls) == 1:
+                # Another request writes between the read and the write of this update
+                other.set('s1', {'count': 10})
+            return {'count': fields['count'] + 1}
+
+        self.assertEqual(self.store.update('s1', ['count'], increment), {'count': 11})
+        self.assertEqual(calls, [0, 10])
+        self.assertEqual(self.store.get('s1'), {'count': 11, 'other': 'x'})
+
+    def test_concurrent_updates_are_not_lost(self):
+        self.store.create('s1', {'count': 0})
+        threads_count, updates = 4, 10
+
+        def worker():
+            store = SessionStore(fakeredis.FakeRedis(server=self.server), prefix='test:state:')
+            for _ in range(updates):
+                while True:
+                    try:
+                        store.update('s1', ['count'], lambda fields: {'count': fields['count'] + 1})
+                        break
+                    except redis.WatchError:
+                        pass
+
+        threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.store.get('s1'), {'count': threads_count * updates})
+
+    def test_update_gives_up_when_session_keeps_changing(self):
+        self.store.create('s1', {'count': 0})
+        other = SessionStore(fakeredis.FakeRedis(server=self.server), prefix='test:state:')
+        calls = []
+
+        def always_interrupted(fields):
+            calls.append(fields['count'])
+            other.set('s1', {'count': fields['count'] + 100})
+            return {'count': fields['count'] + 1}
+
+        with self.assertRaises(redis.WatchError):
+            self.store.update('s1', ['count'], always_interrupted)
+        self.assertEqual(len(calls), SESSION_UPDATE_RETRIES)
+
+
+if __name__ == '__main__':
+    unittest.main()